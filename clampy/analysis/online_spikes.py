@@ -0,0 +1,209 @@
+"""
+Online spike detection, on a voltage trace acquired in successive chunks.
+"""
+from numpy import *
+from .spike_analysis import find_spike_criterion, find_onset_criterion
+
+__all__ = ['OnlineSpikeDetector']
+
+def as_float(x):
+    # Removes units
+    if x is None:
+        return None
+    return float(asarray(x))
+
+class OnlineSpikeDetector(object):
+    '''
+    Detects spikes in a voltage trace given in successive chunks (e.g. from `Board.stream`),
+    with the same definitions of peaks and onsets as `spike_peaks` and `spike_onsets`.
+
+    Threshold crossings, peaks and onsets that span chunk boundaries are handled:
+    the end of each chunk is kept until the next one. A spike is emitted as soon as its peak
+    is detected, i.e., one sample after the peak.
+
+    The spike criterion `vc` and the onset criterion are either fixed or learned on the first
+    `learning_time` seconds of the trace (spikes in this period are emitted at the end of it),
+    and then possibly updated every `update_interval` seconds on the last `learning_time` seconds.
+    If they cannot be learned (e.g. there are no spikes), they are learned on the next `learning_time` seconds.
+
+    Example
+    -------
+    detector = OnlineSpikeDetector(dt, vc=-20*mV)
+    for V in board.stream('V', Ic=Ic, chunk_size=1000):
+        spikes = detector.process(V)
+        print(detector.rate())
+    '''
+    def __init__(self, dt, vc=None, criterion=None, learning_time=1., update_interval=None, rate_window=1.,
+                 history=10000):
+        '''
+        Parameters
+        ----------
+        dt : time step
+        vc : spike criterion (voltage above which we consider we have a spike); learned if None
+        criterion : onset criterion on dv (per time step); learned if None
+        learning_time : duration of the trace used to learn the criteria
+        update_interval : if not None, interval between updates of the learned criteria
+        rate_window : duration over which the firing rate is calculated
+        history : maximum number of samples kept before the current chunk, to find spike onsets
+
+        Quantities with units (e.g. Brian quantities) are converted to floats in SI units, as the traces.
+        '''
+        self.dt = as_float(dt)
+        self.fixed_vc, self.fixed_criterion = as_float(vc), as_float(criterion)
+        self.learning_samples = int(round(as_float(learning_time)/self.dt))
+        self.update_interval = as_float(update_interval)
+        self.rate_window = as_float(rate_window)
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts a new trace.
+        '''
+        self.vc, self.criterion = self.fixed_vc, self.fixed_criterion
+        self.learned = (self.vc is not None) and (self.criterion is not None)
+        self.learning = [] # chunks before the criteria are learned
+        self.recent = zeros(0) # last samples, to update the criteria
+        self.last_update = 0
+        self.tail = zeros(0) # end of the previous chunks
+        self.offset = 0 # index of the first sample of the tail
+        self.checked = 0 # crossings have been searched up to this index
+        self.crossing = None # crossing whose peak is not found yet
+        self.previous_peak = 0
+        self.previous_onset = 0
+        self.n = 0 # number of samples processed
+        self.peaks = [] # indexes of all peaks
+        self.onsets = [] # indexes of all onsets
+
+    def learn(self, v):
+        '''
+        Learns the criteria that are not fixed on trace `v`.
+        Returns False if they cannot be learned (e.g. no spikes), in which case they are unchanged.
+        '''
+        try:
+            vc = find_spike_criterion(v) if self.fixed_vc is None else self.fixed_vc
+            criterion = find_onset_criterion(v, vc=vc) if self.fixed_criterion is None else self.fixed_criterion
+        except (IndexError, ValueError):
+            return False
+        self.vc, self.criterion = vc, criterion
+        return True
+
+    def process(self, chunk):
+        '''
+        Processes a chunk of the trace.
+
+        Returns
+        -------
+        The spikes detected in this chunk, as a dictionary of arrays: onset and peak (sample indexes
+        since the start of the trace), threshold and peak_value (voltage at onset and peak).
+        '''
+        chunk = array(chunk, dtype=float) # copied, since streamed chunks are overwritten
+        self.n += len(chunk)
+
+        # Learn and update the criteria
+        if not self.learned:
+            self.learning.append(chunk)
+            if sum([len(x) for x in self.learning]) < self.learning_samples:
+                return self.events([], [], zeros(0), 0)
+            chunk = concatenate(self.learning)
+            self.learning = []
+            if not self.learn(chunk): # learning starts again on the next chunks
+                return self.events([], [], zeros(0), 0)
+            self.learned = True
+            self.last_update = self.n
+            self.offset = self.checked = self.previous_peak = self.previous_onset = self.n - len(chunk)
+        if self.update_interval is not None:
+            self.recent = concatenate((self.recent, chunk))[-self.learning_samples:]
+            if self.n - self.last_update >= self.update_interval/self.dt:
+                self.learn(self.recent)
+                self.last_update = self.n
+
+        v = concatenate((self.tail, chunk))
+        offset = self.offset
+        dv = diff(v)
+        d2v = diff(dv)
+        peaks, onsets = [], []
+
+        # Crossings of vc, from the last checked pair of samples
+        start = max(self.checked - offset, 0)
+        crossings = list(((v[start+1:] > self.vc) & (v[start:-1] < self.vc)).nonzero()[0] + start + offset)
+        self.checked = offset + len(v) - 1
+        if self.crossing is not None:
+            crossings.insert(0, self.crossing)
+            self.crossing = None
+        decreasing = (dv <= 0).nonzero()[0] + offset
+        for crossing in crossings:
+            # Peak: first decreasing point after the crossing
+            k = searchsorted(decreasing, crossing)
+            if k == len(decreasing): # not yet
+                self.crossing = crossing
+                break
+            peak = decreasing[k]
+            onset = self.find_onset(v, offset, dv, d2v, peak)
+            if onset is not None:
+                peaks.append(peak)
+                onsets.append(onset)
+                self.previous_onset = onset
+            self.previous_peak = peak
+
+        # Keep the end of the trace, from the previous peak or pending crossing (at most `history` samples),
+        # and at least the last sample
+        keep = self.previous_peak if self.crossing is None else min(self.previous_peak, self.crossing)
+        keep = max(keep, offset + len(v) - self.history, offset)
+        keep = min(keep, offset + len(v) - 1)
+        self.tail = v[keep - offset:]
+        self.offset = keep
+
+        self.peaks.extend(peaks)
+        self.onsets.extend(onsets)
+        return self.events(onsets, peaks, v, offset)
+
+    def find_onset(self, v, offset, dv, d2v, peak):
+        '''
+        Returns the onset of the spike with the given peak, as `spike_onsets`, or None if it is not found.
+        '''
+        # Last peak of the derivative before the peak
+        first = max(self.previous_peak, offset) - offset
+        last = peak - 3 - offset
+        if last < first:
+            return None
+        sign_changes = (d2v[first:last+1] * d2v[first+1:last+2] < 0).nonzero()[0]
+        if len(sign_changes) == 0:
+            return None
+        inflexion = sign_changes[-1] + first + 2
+        # Last point before the inflexion point where dv is below the criterion
+        first = max(self.previous_onset - offset, 0)
+        below = (dv[first:inflexion] < self.criterion).nonzero()[0]
+        if len(below) == 0:
+            return None
+        return below[-1] + first + 1 + offset
+
+    def events(self, onsets, peaks, v, offset):
+        onsets, peaks = array(onsets, dtype=int), array(peaks, dtype=int)
+        return dict(onset=onsets, peak=peaks, threshold=v[onsets - offset], peak_value=v[peaks - offset])
+
+    def process_stream(self, chunks):
+        '''
+        Processes an iterable of chunks (e.g. `Board.stream`), yielding each chunk with its spikes.
+
+        Example
+        -------
+        for V, spikes in detector.process_stream(board.stream('V', chunk_size=1000)):
+            print(len(spikes['peak']), detector.rate())
+        '''
+        for chunk in chunks:
+            yield chunk, self.process(chunk)
+
+    def rate(self, window=None):
+        '''
+        Firing rate over the last `window` seconds (default: `rate_window`).
+        '''
+        if window is None:
+            window = self.rate_window
+        window = as_float(window)
+        window = min(window, self.n*self.dt)
+        if window <= 0:
+            return 0.
+        start = self.n - window/self.dt
+        k = searchsorted(self.peaks, start)
+        return (len(self.peaks) - k)/window
@@ -7,10 +7,12 @@ Analysis of spikes in voltage traces.
 from numpy import *
 from scipy import optimize
 from scipy.signal import lfilter, lfiltic
+from numpy.lib.stride_tricks import as_strided
 
 __all__ = ['find_spike_criterion', 'spike_peaks', 'spike_onsets', 'find_onset_criterion',
          'slope_threshold', 'vm_threshold', 'spike_shape', 'spike_duration', 'reset_potential',
-         'spike_mask', 'lowpass']
+         'spike_durations', 'reset_potentials', 'spike_mask', 'lowpass', 'SpikeAnalyzer',
+         'spike_waveforms']
 
 def lowpass(x, tau, dt=1.):
     """
@@ -29,8 +31,22 @@ def spike_duration(v, onsets=None, full=False):
     * Total duration from onset to next minimum
     * Standard deviations for these 3 values
     '''
+    time_to_peak, spike_width, total_duration = spike_durations(v, onsets)
+    if full:
+        return mean(time_to_peak), mean(spike_width), mean(total_duration), \
+               std(time_to_peak), std(spike_width), std(total_duration)
+    else:
+        return mean(total_duration)
+
+def spike_durations(v, onsets=None, dv=None):
+    '''
+    Durations of each spike, in time steps:
+    * Time from onset to peak
+    * Time from onset down to same value (spike width)
+    * Total duration from onset to next minimum
+    '''
     if onsets is None: onsets = spike_onsets(v)
-    dv = diff(v)
+    if dv is None: dv = diff(v)
     total_duration = []
     time_to_peak = []
     spike_width = []
@@ -42,19 +58,14 @@ def spike_duration(v, onsets=None, full=False):
         total_duration.append(((dv[spike:next_spike - 1] <= 0) & (dv[spike + 1:next_spike] > 0)).argmax())
         time_to_peak.append((dv[spike:next_spike] <= 0).argmax())
         spike_width.append((v[spike + 1:next_spike] <= v[spike]).argmax())
-    if full:
-        return mean(time_to_peak), mean(spike_width), mean(total_duration), \
-               std(time_to_peak), std(spike_width), std(total_duration)
-    else:
-        return mean(total_duration)
+    return array(time_to_peak, dtype=int), array(spike_width, dtype=int), array(total_duration, dtype=int)
 
-def reset_potential(v, peaks=None, full=False):
+def reset_potentials(v, peaks=None, dv=None):
     '''
-    Average reset potential, calculated as next minimum after spike peak.
-    If full is True, also returns the standard deviation.
+    Reset potential of each spike, calculated as next minimum after spike peak.
     '''
     if peaks is None: peaks = spike_peaks(v)
-    dv = diff(v)
+    if dv is None: dv = diff(v)
     reset = []
     for i, spike in enumerate(peaks):
         if i == len(peaks) - 1:
@@ -62,6 +73,14 @@ def reset_potential(v, peaks=None, full=False):
         else:
             next_spike = peaks[i + 1]
         reset.append(v[spike + ((dv[spike:next_spike - 1] <= 0) & (dv[spike + 1:next_spike] > 0)).argmax() + 1])
+    return array(reset)
+
+def reset_potential(v, peaks=None, full=False):
+    '''
+    Average reset potential, calculated as next minimum after spike peak.
+    If full is True, also returns the standard deviation.
+    '''
+    reset = reset_potentials(v, peaks)
     if full:
         return mean(reset), std(reset)
     else:
@@ -83,58 +102,113 @@ def find_spike_criterion(v):
     i = argmax(diff(vc)) # I think there is a mistake, I should sort vc first
     return .5 * (vc[i] + vc[i + 1])
 
-def spike_peaks(v, vc=None):
+def pad_spikes(spikes, fill=-1):
+    '''
+    Converts a list of arrays of spike indexes (one per trial) to a 2D array,
+    padded with `fill`.
+    '''
+    padded = full((len(spikes), max([len(s) for s in spikes] + [0])), fill, dtype=int)
+    for k, s in enumerate(spikes):
+        padded[k, :len(s)] = s
+    return padded
+
+def per_trial(function, v, padded, **parameters):
+    '''
+    Applies a spike detection function to each row of a 2D array (trials, samples).
+    Parameters that are None are determined for each trial; others can be given for each trial
+    (as arrays) or for all trials.
+    '''
+    spikes = []
+    for k, trace in enumerate(v):
+        trial_parameters = dict((name, value if (value is None or ndim(value) == 0) else value[k])
+                                for name, value in parameters.items())
+        spikes.append(function(trace, **trial_parameters))
+    if padded:
+        return pad_spikes(spikes)
+    return spikes
+
+def spike_peaks(v, vc=None, padded=False):
     '''
     Returns the indexes of spike peaks.
     vc is the spike criterion (voltage above which we consider we have a spike)
+
+    v can be a 2D array (trials, samples). Then the result is a list of arrays, one per trial,
+    or a 2D array padded with -1 if padded is True. vc can be given for each trial.
     '''
     # Possibly: add refractory criterion
+    v = asarray(v)
+    if v.ndim == 2:
+        return per_trial(spike_peaks, v, padded, vc=vc)
     if vc is None: vc = find_spike_criterion(v)
     dv = diff(v)
     spikes = ((v[1:] > vc) & (v[:-1] < vc)).nonzero()[0]
-    peaks = []
-    if len(spikes) > 0:
-        for i in range(len(spikes) - 1):
-            peaks.append(spikes[i] + (dv[spikes[i]:spikes[i + 1]] <= 0).nonzero()[0][0])
-        decreasing = (dv[spikes[-1]:] <= 0).nonzero()[0]
-        if len(decreasing) > 0:
-            peaks.append(spikes[-1] + decreasing[0])
-        else:
-            peaks.append(len(dv)) # last element (maybe should be deleted?)
-    return array(peaks)
+    # First decreasing point after each crossing
+    # (before the next crossing, since v goes below vc in between)
+    decreasing = (dv <= 0).nonzero()[0]
+    k = searchsorted(decreasing, spikes)
+    found = k < len(decreasing)
+    peaks = full(len(spikes), len(dv), dtype=int) # last element if not found (maybe should be deleted?)
+    peaks[found] = decreasing[k[found]]
+    return peaks
 
-def spike_onsets(v, criterion=None, vc=None):
+def spike_inflexions(peaks, d2v):
+    '''
+    Returns the indexes of the last peak of the derivative before each spike peak
+    (sign change of d2v, between the previous peak and the peak).
+    '''
+    # (commented: point where derivative is largest)
+    sign_changes = (d2v[:-1] * d2v[1:] < 0).nonzero()[0]
+    previous_peaks = concatenate(([0], peaks[:-1]))
+    k = searchsorted(sign_changes, peaks - 3, side='right') - 1
+    if any(k < 0) or any(sign_changes[maximum(k, 0)] < previous_peaks):
+        raise IndexError('No inflexion point before a spike peak')
+    return sign_changes[k] + 2
+
+def spike_onsets(v, criterion=None, vc=None, padded=False, dv=None, d2v=None, peaks=None):
     '''
     Returns the indexes of spike onsets.
     vc is the spike criterion (voltage above which we consider we have a spike).
     First derivative criterion (dv>criterion).
+
+    v can be a 2D array (trials, samples). Then the result is a list of arrays, one per trial,
+    or a 2D array padded with -1 if padded is True. criterion and vc can be given for each trial.
+
+    dv, d2v and peaks (first and second derivatives, spike peaks) can be given if already calculated
+    (1D traces only).
     '''
+    v = asarray(v)
+    if v.ndim == 2:
+        return per_trial(spike_onsets, v, padded, criterion=criterion, vc=vc)
     if vc is None: vc = find_spike_criterion(v)
-    if criterion is None: criterion = find_onset_criterion(v, vc=vc)
-    peaks = spike_peaks(v, vc)
-    dv = diff(v)
-    d2v = diff(dv)
-    previous_i = 0
-    j = 0
-    l = []
-
-    for i in peaks:
-        # Find last peak of derivative (commented: point where derivative is largest)
-        # inflexion = previous_i + argmax(dv[previous_i:i])
-        inflexion=where(d2v[previous_i:i-2]*d2v[previous_i+1:i-1]<0)[0][-1]+2+previous_i
-        j += max((dv[j:inflexion] < criterion).nonzero()[0]) + 1
-        l.append(j)
-        previous_i = i
+    if dv is None: dv = diff(v)
+    if d2v is None: d2v = diff(dv)
+    if peaks is None: peaks = spike_peaks(v, vc)
+    if criterion is None: criterion = find_onset_criterion(v, vc=vc, dv=dv, d2v=d2v, peaks=peaks)
+    if len(peaks) == 0:
+        return array([], dtype=int)
+    inflexions = spike_inflexions(peaks, d2v)
 
-    return array(l)
+    # Last point before the inflexion point where dv is below the criterion, after the previous onset
+    below = (dv < criterion).nonzero()[0]
+    k = searchsorted(below, inflexions) - 1
+    if any(k < 0):
+        raise ValueError('No point below the onset criterion before a spike')
+    onsets = below[k] + 1
+    if any(onsets[1:] <= onsets[:-1]):
+        raise ValueError('No point below the onset criterion between two spikes')
+    return onsets
 
-def find_onset_criterion(v, guess=0.0001, vc=None):
+def find_onset_criterion(v, guess=0.0001, vc=None, dv=None, d2v=None, peaks=None):
     '''
     Finds the best criterion on dv/dt to determine spike onsets,
     based on minimum threshold variability.
+    dv, d2v and peaks (first and second derivatives, spike peaks) can be given if already calculated.
     '''
     if vc is None: vc = find_spike_criterion(v)
-    return float(optimize.fmin(lambda x:std(v[spike_onsets(v, x, vc)]), guess, disp=0))
+    if dv is None: dv = diff(v)
+    if d2v is None: d2v = diff(dv)
+    if peaks is None: peaks = spike_peaks(v, vc)
+    return float(optimize.fmin(lambda x:std(v[spike_onsets(v, x, vc, dv=dv, d2v=d2v, peaks=peaks)]), guess, disp=0))
 
 def spike_shape(v, onsets=None, before=100, after=100):
     '''
@@ -146,21 +220,43 @@ def spike_shape(v, onsets=None, before=100, after=100):
     after: number of timesteps after onset
     '''
     if onsets is None: onsets = spike_onsets(v)
-    shape = zeros(after + before)
-    for i in onsets:
-        v0 = v[max(0, i - before):i + after]
-        shape[len(shape) - len(v0):] += v0
-    return shape / len(onsets)
+    return spike_waveforms(v, onsets, before, after, fill=0.).sum(axis=0) / len(onsets)
+
+def spike_waveforms(v, onsets=None, before=100, after=100, fill=nan):
+    '''
+    Returns the waveforms of all spikes, as an array (number of spikes, before + after),
+    aligned on spike onset by default (to align on peaks, just pass onsets=peaks).
+    Windows are gathered in one step from a strided view on the trace (the result is a new array).
+    The trace is padded only if some windows extend beyond its edges; these parts are set to `fill`.
+
+    onsets: spike onset times
+    before: number of timesteps before onset
+    after: number of timesteps after onset
+    '''
+    v = asarray(v)
+    if onsets is None: onsets = spike_onsets(v)
+    onsets = asarray(onsets, dtype=int)
+    width = before + after
+    if len(onsets) == 0 or width == 0:
+        return zeros((len(onsets), width), dtype=v.dtype)
+    # Pad the trace only if needed
+    left = max(before - onsets.min(), 0)
+    right = max(onsets.max() + after - len(v), 0)
+    if left > 0 or right > 0:
+        v = concatenate((full(left, fill, dtype=v.dtype), v, full(right, fill, dtype=v.dtype)))
+    windows = as_strided(v, shape=(len(v) - width + 1, width), strides=(v.strides[0], v.strides[0]),
+                         writeable=False)
+    return windows[onsets + left - before]
 
 def vm_threshold(v, onsets=None, T=None):
     '''
     Average membrane potential before spike threshold (T steps).
     '''
     if onsets is None: onsets = spike_onsets(v)
-    l = []
-    for i in onsets:
-        l.append(mean(v[max(0, i - T):i]))
-    return array(l)
+    if len(onsets) == 0:
+        return array([])
+    waveforms = spike_waveforms(v, onsets, T, 0) # nan before the trace
+    return nanmean(waveforms, axis=1)
 
 def slope_threshold(v, onsets=None, T=None):
     '''
@@ -168,14 +264,13 @@ def slope_threshold(v, onsets=None, T=None):
     Returns all slopes as an array.
     '''
     if onsets is None: onsets = spike_onsets(v)
-    l = []
-    for i in onsets:
-        v0 = v[max(0, i - T):i]
-        M = len(v0)
-        x = arange(M) - M + 1
-        slope = sum((v0 - v[i]) * x) / sum(x ** 2)
-        l.append(slope)
-    return array(l)
+    if len(onsets) == 0:
+        return array([])
+    v = asarray(v)
+    waveforms = spike_waveforms(v, onsets, T, 0) # nan before the trace
+    x = arange(T) - T + 1
+    valid = ~isnan(waveforms)
+    return nansum((waveforms - v[onsets][:, None]) * x, axis=1) / (valid * x ** 2).sum(axis=1)
 
 def spike_mask(v, spikes=None, T=None):
     '''
@@ -200,3 +295,161 @@ def spike_mask(v, spikes=None, T=None):
         for i in spikes:
             ind[i:i + T] = True
     return ind
+
+class cached_property(object):
+    '''
+    A property that is calculated when first accessed, then stored in the instance.
+    '''
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.function.__name__] = self.function(instance)
+        return value
+
+class SpikeAnalyzer(object):
+    '''
+    Spike analysis of a voltage trace.
+
+    Intermediate quantities (derivatives, spike criterion, onset criterion, peaks, onsets)
+    and features are calculated when first needed, and only once.
+    Durations are in time units (steps multiplied by dt), slopes in voltage per time unit.
+
+    Example
+    -------
+    spikes = SpikeAnalyzer(v, dt=0.1*ms, T=10)
+    print(spikes.threshold.mean(), spikes.duration.mean())
+    table = spikes.features()
+    '''
+    def __init__(self, v, dt=1., vc=None, criterion=None, T=None, before=100, after=100):
+        '''
+        Parameters
+        ----------
+        v : voltage trace
+        dt : time step
+        vc : spike criterion (voltage above which we consider we have a spike), calculated if None
+        criterion : onset criterion on dv (per time step), calculated if None
+        T : number of time steps before onset, for `vm_threshold` and `slope_threshold`
+        before, after : number of time steps before and after onset, for `shape`
+        '''
+        self.v = asarray(v)
+        self.dt = dt
+        self.T = T
+        self.before = before
+        self.after = after
+        if vc is not None:
+            self.vc = vc
+        if criterion is not None:
+            self.criterion = criterion
+
+    @cached_property
+    def dv(self):
+        return diff(self.v)
+
+    @cached_property
+    def d2v(self):
+        return diff(self.dv)
+
+    @cached_property
+    def vc(self):
+        '''Spike criterion'''
+        return find_spike_criterion(self.v)
+
+    @cached_property
+    def criterion(self):
+        '''Onset criterion on dv'''
+        return find_onset_criterion(self.v, vc=self.vc, dv=self.dv, d2v=self.d2v, peaks=self.peaks)
+
+    @cached_property
+    def peaks(self):
+        '''Indexes of spike peaks'''
+        return spike_peaks(self.v, self.vc)
+
+    @cached_property
+    def onsets(self):
+        '''Indexes of spike onsets'''
+        return spike_onsets(self.v, self.criterion, self.vc, dv=self.dv, d2v=self.d2v, peaks=self.peaks)
+
+    @cached_property
+    def onset_times(self):
+        return self.onsets*self.dt
+
+    @cached_property
+    def peak_times(self):
+        return self.peaks*self.dt
+
+    @cached_property
+    def threshold(self):
+        '''Voltage at spike onsets'''
+        return self.v[self.onsets]
+
+    @cached_property
+    def peak_value(self):
+        '''Voltage at spike peaks'''
+        return self.v[self.peaks]
+
+    @cached_property
+    def durations(self):
+        '''Time to peak, spike width and total duration of each spike, in time steps (see `spike_durations`)'''
+        return spike_durations(self.v, self.onsets, self.dv)
+
+    @cached_property
+    def time_to_peak(self):
+        return self.durations[0]*self.dt
+
+    @cached_property
+    def width(self):
+        return self.durations[1]*self.dt
+
+    @cached_property
+    def duration(self):
+        return self.durations[2]*self.dt
+
+    @cached_property
+    def reset(self):
+        '''Reset potential after each spike'''
+        return reset_potentials(self.v, self.peaks, self.dv)
+
+    @cached_property
+    def vm_threshold(self):
+        '''Average membrane potential in the T steps before each onset'''
+        if self.T is None:
+            raise ValueError('T must be set')
+        return vm_threshold(self.v, self.onsets, self.T)
+
+    @cached_property
+    def slope_threshold(self):
+        '''Slope of membrane potential in the T steps before each onset'''
+        if self.T is None:
+            raise ValueError('T must be set')
+        return slope_threshold(self.v, self.onsets, self.T)/self.dt
+
+    @cached_property
+    def waveforms(self):
+        '''Waveforms of all spikes, aligned on onsets (before, after), padded with nan (see `spike_waveforms`)'''
+        return spike_waveforms(self.v, self.onsets, self.before, self.after)
+
+    @cached_property
+    def shape(self):
+        '''Average spike shape, aligned on onsets'''
+        return spike_shape(self.v, self.onsets, self.before, self.after)
+
+    @cached_property
+    def mask(self):
+        '''True in spikes (from onset to next minimum)'''
+        return spike_mask(self.v, self.onsets)
+
+    def features(self):
+        '''
+        Returns a table of features, as a dictionary of arrays with one element per spike:
+        onsets and peaks (indexes), onset_times, peak_times, threshold, peak_value, time_to_peak, width,
+        duration, reset, and vm_threshold and slope_threshold if T is set.
+        '''
+        names = ['onsets', 'peaks', 'onset_times', 'peak_times', 'threshold', 'peak_value',
+                 'time_to_peak', 'width', 'duration', 'reset']
+        if self.T is not None:
+            names += ['vm_threshold', 'slope_threshold']
+        return dict((name, getattr(self, name)) for name in names)
@@ -7,6 +7,7 @@ __all__ = ['BrianExperiment', 'TwoCompartmentModel', 'SpatialBrianExperiment', '
 
 from brian2 import *
 from clampy.devices import Board
+from clampy.devices.board import zip_chunks
 
 class BrianExperiment(Board):
     '''
@@ -53,7 +54,8 @@ class BrianExperiment(Board):
     def voltage_clamp(self, channel=None):
         self.is_voltage_clamp = True
 
-    def acquire_raw(self, analog_inputs=None, analog_outputs=None, digital_inputs=None, digital_outputs=None, input_range={}):
+    def acquire_raw(self, analog_inputs=None, analog_outputs=None, digital_inputs=None, digital_outputs=None, input_range={},
+                    out=None):
         '''
         Send commands and acquire signals.
 
@@ -63,7 +65,9 @@ class BrianExperiment(Board):
             A list of input variables to acquire. From: V, I, Ve (electrode potential)
             A maximum of two inputs.
         analog_outputs
-            A dictionary of commands.
+            A dictionary of commands (with units, or plain arrays in SI units).
+        out
+            An optional list of arrays to write the values into.
         '''
         if analog_outputs != {}: # We might to do a more thorough checking
             nsamples = len(list(analog_outputs.values())[0])
@@ -72,13 +76,13 @@ class BrianExperiment(Board):
 
         self.neuron.t_start = self.network.t
         if 'Vc' in analog_outputs:
-            Vcommand = TimedArray(analog_outputs['Vc'], dt=self.dt, name='Vclamp')
+            Vcommand = TimedArray(asarray(analog_outputs['Vc'])*volt, dt=self.dt, name='Vclamp')
             if not 'Ic' in analog_outputs: # Automatic mode switch
                 self.voltage_clamp()
         else:
             Vcommand = TimedArray([0 * volt], dt=self.dt, name='Vclamp')
         if 'Ic' in analog_outputs:
-            Icommand = TimedArray(analog_outputs['Ic'], dt=self.dt, name='Iclamp')
+            Icommand = TimedArray(asarray(analog_outputs['Ic'])*amp, dt=self.dt, name='Iclamp')
             if not 'Vc' in analog_outputs:
                 self.current_clamp()
         else:
@@ -91,11 +95,60 @@ class BrianExperiment(Board):
         self.network.run(nsamples * self.dt)
 
         results = [self.monitor[0].__getattr__(name) for name in analog_inputs]
+        if out is not None:
+            for value, result in zip(out, results):
+                copyto(value, result)
+            results = list(out)
 
         self.network.remove(self.monitor)
 
         return results
 
+    def stream_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={},
+                   chunk_size=None, nchunks=None):
+        '''
+        Continuous acquisition, running the network in chunks.
+        The state of the model carries over from one chunk to the next, and a single monitor
+        is emptied after each chunk, so that memory use does not grow.
+
+        Parameters
+        ----------
+        analog_inputs
+            A list of input variables to acquire.
+        analog_outputs
+            A dictionary of iterators over command chunks.
+        chunk_size
+            Number of samples per chunk.
+        nchunks
+            Number of chunks (None = until a command iterator is exhausted, or forever).
+        '''
+        # The mode is chosen once for the whole stream
+        if ('Vc' in analog_outputs) and not ('Ic' in analog_outputs):
+            self.voltage_clamp()
+        elif ('Ic' in analog_outputs) and not ('Vc' in analog_outputs):
+            self.current_clamp()
+        self.neuron.gclamp[0] = self.gclamp * self.is_voltage_clamp
+
+        self.monitor = StateMonitor(self.neuron, analog_inputs, record=[0], dt = self.dt)
+        self.network.add(self.monitor)
+        try:
+            for analog_chunk, _ in zip_chunks(analog_outputs, {}, nchunks):
+                self.neuron.t_start = self.network.t
+                # Chunks are plain arrays in SI units
+                if 'Vc' in analog_chunk:
+                    Vcommand = TimedArray(asarray(analog_chunk['Vc'])*volt, dt=self.dt, name='Vclamp')
+                else:
+                    Vcommand = TimedArray([0 * volt], dt=self.dt, name='Vclamp')
+                if 'Ic' in analog_chunk:
+                    Icommand = TimedArray(asarray(analog_chunk['Ic'])*amp, dt=self.dt, name='Iclamp')
+                else:
+                    Icommand = TimedArray([0 * amp], dt=self.dt, name='Iclamp')
+                self.network.run(chunk_size * self.dt)
+                yield [self.monitor[0].__getattr__(name)[:chunk_size] for name in analog_inputs]
+                self.monitor.resize(0)
+        finally:
+            self.network.remove(self.monitor)
+
 class TwoCompartmentModel(BrianExperiment):
     '''
     A two compartment model with soma and AIS.
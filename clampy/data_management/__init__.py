@@ -1 +1,12 @@
-from .data_management import *
\ No newline at end of file
+from .data_management import *
+from .writer import *
+from .storage import *
+from .waveforms import *
+from .codec import *
+from .container import *
+from .lazy import *
+from .catalog import *
+from .text_cache import *
+from .recording import *
+from .convert import *
+from .reduce import *
@@ -0,0 +1,363 @@
+'''
+Catalog of recordings, stored in a SQLite database.
+
+Recordings are the folders named `<date_time> <protocol>` (see `date_time`),
+for example `data/3.2.2020 15.30.12 Current clamp`.
+'''
+from future.utils import iteritems
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+import zipfile
+from datetime import datetime
+import numpy as np
+from .container import is_container, manifest_name
+from .waveforms import waveform_store
+from .storage import StoredData
+
+__all__ = ['Catalog']
+
+recording_pattern = re.compile(r'^(\d+)\.(\d+)\.(\d+) (\d+)\.(\d+)\.(\d+)\s*(.*)$')
+data_extensions = ['.npz', '.txt', '.gz']
+info_extensions = ['.info', '.json']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY, date REAL, protocol TEXT, dt REAL, info TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, recording TEXT, mtime REAL, size INTEGER, kind TEXT, dt REAL, info TEXT);
+CREATE TABLE IF NOT EXISTS signals (
+    file TEXT, recording TEXT, name TEXT, shape TEXT, dtype TEXT);
+CREATE TABLE IF NOT EXISTS parameters (
+    recording TEXT, name TEXT, value);
+CREATE INDEX IF NOT EXISTS files_recording ON files (recording);
+CREATE INDEX IF NOT EXISTS signals_recording ON signals (recording);
+CREATE INDEX IF NOT EXISTS signals_file ON signals (file);
+CREATE INDEX IF NOT EXISTS parameters_recording ON parameters (recording);
+'''
+
+def recording_date(folder):
+    '''
+    Returns the date of a recording folder as a timestamp, or None if the folder is not a recording.
+    '''
+    result = recording_pattern.match(folder)
+    if result is None:
+        return None
+    day, month, year, hour, minute, second = [int(x) for x in result.groups()[:6]]
+    try:
+        return time.mktime(datetime(year, month, day, hour, minute, second).timetuple())
+    except ValueError: # not a valid date
+        return None
+
+def npy_header(f):
+    # Shape and dtype of a .npy file, from its header
+    if np.lib.format.read_magic(f) == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return tuple(shape), dtype.str
+
+def npz_signals(filename):
+    '''
+    Returns the shape and dtype of the signals of a .npz file, as read by `load_data`,
+    and the sampling step if it can be deduced.
+    Encoding keys are not listed, and signals are described as decoded (see `StoredData`),
+    mostly from array headers.
+    '''
+    headers = dict()
+    with zipfile.ZipFile(filename) as archive:
+        for member in archive.namelist():
+            if member.endswith('.npy'):
+                with archive.open(member) as f:
+                    headers[member[:-4]] = npy_header(f)
+    signals = dict()
+    dt = None
+    with np.load(filename) as npz:
+        data = StoredData(npz, os.path.dirname(filename))
+        reconstructed_t = 'dt' in data.encoded
+        for name in data:
+            if (name == 't') and reconstructed_t:
+                continue
+            if name in data.references: # commands stored by reference
+                waveform = waveform_store(data.directory).filename(str(npz[data.references[name]]))
+                try:
+                    with open(waveform, 'rb') as f:
+                        signals[name] = npy_header(f)
+                except IOError: # missing waveform
+                    pass
+            elif name in data.compressed: # compressed with delta_encode
+                info = json.loads(str(npz['delta_info_'+name]))
+                signals[name] = (tuple(info['shape']), info['dtype'])
+            elif 'scale_'+name in data.encoded: # integer storage, scaled to float
+                signals[name] = (headers[name][0], '<f8')
+            else:
+                signals[name] = headers[name]
+        if reconstructed_t: # time from t0 and dt
+            shapes = [signals[name][0] for name in data.names if (name in signals) and len(signals[name][0]) > 0]
+            signals['t'] = ((shapes[0][-1] if len(shapes) > 0 else 0,), '<f8')
+        if 'dt' in headers:
+            dt = float(npz['dt'])
+        elif ('t' in signals) and (np.prod(signals['t'][0]) > 1):
+            t = data['t']
+            dt = float(t[1] - t[0])
+    return signals, dt
+
+def text_signals(filename):
+    '''
+    Returns the shape of the signals of a text data file, and the sampling step if there is a `t` column.
+    Files without a header (saved with `savetxt`) are a single 2D signal named after the file.
+    '''
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rt')
+    else:
+        f = open(filename, 'r')
+    with f:
+        variables = f.readline().split()
+        first_lines = [f.readline() for _ in range(2)]
+        nrows = len([line for line in first_lines if line.strip() != '']) + sum(1 for _ in f)
+    try: # no header
+        ncolumns = len([float(x) for x in variables])
+        name = os.path.basename(filename).split('.')[0]
+        if ncolumns == 1: # 1D, as read by loadtxt
+            shape = (nrows+1,)
+        elif nrows == 0:
+            shape = (ncolumns,)
+        else:
+            shape = (nrows+1, ncolumns)
+        return {name: (shape, '<f8')}, None
+    except ValueError:
+        pass
+    dt = None
+    if ('t' in variables) and (nrows > 1):
+        i = variables.index('t')
+        dt = float(first_lines[1].split()[i]) - float(first_lines[0].split()[i])
+    return dict((name, ((nrows,), '<f8')) for name in variables), dt
+
+class Catalog(object):
+    '''
+    A catalog of recordings, stored in a SQLite database.
+    Recordings are indexed with their date, protocol name, signals (name, shape, dtype),
+    sampling step and parameters (from .info and .json files).
+
+    Example
+    -------
+    catalog = Catalog('catalog.sqlite')
+    catalog.scan('data')
+    recordings = catalog.query(protocol='current clamp', dt=0.1*ms,
+                               after=datetime.now()-timedelta(days=31))
+    '''
+    def __init__(self, database='catalog.sqlite'):
+        '''
+        Parameters
+        ----------
+        database : file name of the database (created if needed)
+        '''
+        self.connection = sqlite3.connect(database)
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def scan(self, root, progress=None):
+        '''
+        Indexes the recordings under `root`.
+        Only files that are new or whose modification time or size changed are read,
+        and files that were removed are removed from the catalog.
+
+        Parameters
+        ----------
+        root : root folder
+        progress : None, or a function called with the path of each file that is indexed
+
+        Returns
+        -------
+        A dictionary with the number of files added, updated, removed and unchanged.
+        '''
+        root = os.path.abspath(root)
+        cursor = self.connection.cursor()
+        known = dict((path, (mtime, size)) for path, mtime, size in
+                     cursor.execute('SELECT path, mtime, size FROM files') if path.startswith(root + os.sep))
+        stats = dict(added=0, updated=0, removed=0, unchanged=0)
+        changed = set()
+        seen = set()
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            # Find the recording folder
+            relative = os.path.relpath(dirpath, root)
+            recording = None
+            if relative != '.':
+                parts = relative.split(os.sep)
+                for i, part in enumerate(parts):
+                    if recording_date(part) is not None:
+                        recording = os.path.join(root, *parts[:i+1])
+                        break
+            if recording is None:
+                continue
+            # Files
+            entries = [(name, 'data') for name in filenames if os.path.splitext(name)[1] in data_extensions] + \
+                      [(name, 'info') for name in filenames if os.path.splitext(name)[1] in info_extensions]
+            if is_container(dirpath): # session container: the manifest is indexed, not the chunks
+                entries = [(manifest_name, 'container')]
+                dirnames[:] = []
+            for name, kind in entries:
+                path = os.path.join(dirpath, name)
+                stat = os.stat(path)
+                seen.add(path)
+                if (path in known) and (known[path] == (stat.st_mtime, stat.st_size)):
+                    stats['unchanged'] += 1
+                    continue
+                stats['updated' if path in known else 'added'] += 1
+                if progress is not None:
+                    progress(path)
+                try:
+                    self.index_file(cursor, path, recording, kind, stat)
+                except Exception: # unreadable file: indexed without signals
+                    cursor.execute('DELETE FROM signals WHERE file = ?', (path,))
+                    cursor.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (path, recording, stat.st_mtime, stat.st_size, kind, None, None))
+                changed.add(recording)
+
+        # Removed files
+        for path in set(known) - seen:
+            recording = cursor.execute('SELECT recording FROM files WHERE path = ?', (path,)).fetchone()[0]
+            cursor.execute('DELETE FROM files WHERE path = ?', (path,))
+            cursor.execute('DELETE FROM signals WHERE file = ?', (path,))
+            changed.add(recording)
+            stats['removed'] += 1
+
+        for recording in changed:
+            self.update_recording(cursor, recording)
+        self.connection.commit()
+        return stats
+
+    def index_file(self, cursor, path, recording, kind, stat):
+        '''
+        Reads the signals or parameters of a file and stores them in the catalog.
+        '''
+        dt, info, signals = None, None, dict()
+        if kind == 'info':
+            with open(path, 'r') as f:
+                info = json.load(f)
+            dt = info.get('dt', None) if isinstance(info, dict) else None
+        elif kind == 'container':
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            dt = manifest['dt']
+            signals = dict((name, ([value['count']] + value['shape'], value['dtype']))
+                           for name, value in iteritems(manifest['signals']))
+        elif path.endswith('.npz'):
+            signals, dt = npz_signals(path)
+        else:
+            signals, dt = text_signals(path)
+        cursor.execute('DELETE FROM signals WHERE file = ?', (path,))
+        cursor.executemany('INSERT INTO signals VALUES (?, ?, ?, ?, ?)',
+                           [(path, recording, name, json.dumps(list(shape)), dtype)
+                            for name, (shape, dtype) in iteritems(signals)])
+        cursor.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (path, recording, stat.st_mtime, stat.st_size, kind, dt,
+                        None if info is None else json.dumps(info)))
+
+    def update_recording(self, cursor, recording):
+        '''
+        Updates the description of a recording from its files.
+        '''
+        cursor.execute('DELETE FROM recordings WHERE path = ?', (recording,))
+        cursor.execute('DELETE FROM parameters WHERE recording = ?', (recording,))
+        files = cursor.execute('SELECT kind, dt, info FROM files WHERE recording = ? ORDER BY path',
+                               (recording,)).fetchall()
+        if len(files) == 0:
+            return
+        info = dict()
+        for kind, _, file_info in files:
+            if file_info is not None:
+                value = json.loads(file_info)
+                if isinstance(value, dict):
+                    info.update(value)
+        # The sampling step of the parameters has priority over the data files
+        dts = [dt for kind, dt, _ in files if (kind == 'info') and (dt is not None)] + \
+              [dt for kind, dt, _ in files if (kind != 'info') and (dt is not None)]
+        folder = os.path.basename(recording)
+        protocol = recording_pattern.match(folder).group(7)
+        cursor.execute('INSERT INTO recordings VALUES (?, ?, ?, ?, ?)',
+                       (recording, recording_date(folder), protocol, dts[0] if len(dts) > 0 else None,
+                        json.dumps(info)))
+        cursor.executemany('INSERT INTO parameters VALUES (?, ?, ?)',
+                           [(recording, name, value if isinstance(value, (int, float, str)) else json.dumps(value))
+                            for name, value in iteritems(info)])
+
+    def query(self, protocol=None, after=None, before=None, dt=None, signal=None, root=None, **parameters):
+        '''
+        Finds recordings.
+
+        Parameters
+        ----------
+        protocol : part of the protocol name (case insensitive)
+        after, before : dates (datetime or timestamp)
+        dt : sampling step, in second (with a relative tolerance of 1e-6)
+        signal : name of a recorded signal
+        root : folder containing the recordings
+        parameters : values of parameters (numbers are compared with a relative tolerance of 1e-6)
+
+        Returns
+        -------
+        A list of dictionaries with keys path, date (datetime), protocol, dt and info (dictionary of parameters),
+        sorted by date.
+
+        Example
+        -------
+        catalog.query(protocol='current clamp', dt=0.1*ms, after=datetime.now()-timedelta(days=31))
+        '''
+        conditions, values = [], []
+        if protocol is not None:
+            conditions.append('LOWER(protocol) LIKE ?')
+            values.append('%' + protocol.lower() + '%')
+        if after is not None:
+            conditions.append('date >= ?')
+            values.append(time.mktime(after.timetuple()) if isinstance(after, datetime) else after)
+        if before is not None:
+            conditions.append('date <= ?')
+            values.append(time.mktime(before.timetuple()) if isinstance(before, datetime) else before)
+        if dt is not None:
+            conditions.append('ABS(dt - ?) <= ?')
+            values.extend([float(dt), 1e-6*abs(float(dt))])
+        if signal is not None:
+            conditions.append('EXISTS (SELECT 1 FROM signals WHERE signals.recording = recordings.path AND name = ?)')
+            values.append(signal)
+        if root is not None:
+            conditions.append('SUBSTR(path, 1, ?) = ?')
+            prefix = os.path.abspath(root) + os.sep
+            values.extend([len(prefix), prefix])
+        for name, value in iteritems(parameters):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                conditions.append('EXISTS (SELECT 1 FROM parameters WHERE parameters.recording = recordings.path '
+                                  'AND name = ? AND ABS(value - ?) <= ?)')
+                values.extend([name, float(value), 1e-6*abs(float(value))])
+            else:
+                conditions.append('EXISTS (SELECT 1 FROM parameters WHERE parameters.recording = recordings.path '
+                                  'AND name = ? AND value = ?)')
+                values.extend([name, value if isinstance(value, str) else json.dumps(value)])
+        sql = 'SELECT path, date, protocol, dt, info FROM recordings'
+        if len(conditions) > 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY date'
+        return [dict(path=path, date=datetime.fromtimestamp(date) if date is not None else None,
+                     protocol=protocol, dt=dt, info=json.loads(info))
+                for path, date, protocol, dt, info in self.connection.execute(sql, values)]
+
+    def signals(self, recording):
+        '''
+        Returns the signals of a recording, as a list of dictionaries with keys file, name, shape and dtype.
+        '''
+        return [dict(file=path, name=name, shape=tuple(json.loads(shape)), dtype=dtype)
+                for path, name, shape, dtype in
+                self.connection.execute('SELECT file, name, shape, dtype FROM signals WHERE recording = ? '
+                                        'ORDER BY file, name', (os.path.abspath(recording),))]
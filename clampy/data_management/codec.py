@@ -0,0 +1,209 @@
+'''
+Lossless compression of signals: integer counts, delta encoding, then byte compression per chunk.
+
+Float signals are converted to integer counts `(value - offset)/step` when they are quantized
+(e.g. signals from an ADC, divided by a gain). Values that differ from `offset + counts*step` by a few
+units in the last place (rounding errors of the scaling) are stored with their difference in bits
+(residuals, mostly zero), so that the encoding is exact. Otherwise, the bit patterns of the values are encoded,
+which is also lossless.
+Counts are differenced along the last axis, mapped to unsigned integers (zigzag encoding),
+stored on the smallest number of bytes, byte-shuffled (all first bytes, then all second bytes...)
+and compressed with zlib, in chunks that are decompressed independently.
+'''
+import json
+import zlib
+import numpy as np
+
+__all__ = ['delta_encode', 'delta_decode']
+
+chunk_size = 65536 # number of values per compressed chunk
+widths = [1, 2, 4, 8]
+tolerance = 1e-6 # largest difference between a value and its quantized level, relative to the step...
+ulps = 16 # ...or in units in the last place of the value
+resolution = 1e-9 # smallest step of an automatic quantization, relative to the largest value
+
+def quantized_levels(value, offset, step):
+    # `offset + counts*step`, in the type of value
+    counts = np.round((value.astype(np.float64) - offset)/step)
+    return counts, (offset + counts*step).astype(value.dtype)
+
+def approximate_quantization(value, offset, step):
+    # True if `offset + counts*step` is close to `value` with integer counts (checked on the first values first)
+    if not (step > 0) or (np.abs(value - offset).max()/step > 2.**52):
+        return False
+    if ulps*np.spacing(np.abs(value).max()) > step/4: # rounding errors would change the level
+        return False
+    for x in [value[:1000], value]:
+        _, levels = quantized_levels(x, offset, step)
+        error = np.abs(levels.astype(np.float64) - x)
+        if np.any((error > tolerance*step) & (error > ulps*np.spacing(np.abs(x)))):
+            return False
+    return True
+
+def quantization(value, step=None):
+    '''
+    Returns (offset, step) such that `offset + counts*step` gives back `value` with integer counts,
+    up to rounding errors, or None if there is none.
+
+    Candidate steps are `step` if given, then estimated from the smallest differences between two
+    distinct levels, refined with the largest values. The offset is 0 or the minimum value.
+    '''
+    value = value.ravel()
+    if value.size == 0 or not np.all(np.isfinite(value)):
+        return None
+    value = value + 0. # -0. is compared as 0.
+    offsets = [0., float(value.min())]
+    steps = [] if step is None else [step]
+    levels = np.unique(value)
+    if len(levels) < 2:
+        steps.append(1.)
+    else:
+        gaps = np.diff(levels)
+        gaps = gaps[gaps > resolution*np.abs(levels).max()] # rounding errors are not levels
+        if len(gaps) > 0:
+            rough = np.median(gaps[gaps < 1.5*gaps.min()]) # averages rounding errors
+            steps.append(rough)
+            for offset in offsets:
+                for x in levels[[0, -1]] - offset:
+                    count = np.round(x/rough)
+                    if count != 0:
+                        steps.append(abs(x/count))
+    for step in steps:
+        for offset in offsets:
+            if approximate_quantization(value, offset, step):
+                return offset, float(step)
+    return None
+
+def bit_difference(x, y):
+    # Difference of the bit patterns of two arrays of the same type, as int64 (wrapping around)
+    size = x.dtype.itemsize
+    return (x.view('u{}'.format(size)) - y.view('u{}'.format(size))).view('i{}'.format(size)).astype(np.int64)
+
+def to_counts(value, step=None):
+    '''
+    Converts an array to int64 counts. Returns the counts, the description of the conversion,
+    and the residuals in bits (int64 array, or None if they are all zero).
+    '''
+    value = value.ravel()
+    if value.dtype.kind == 'f':
+        quantized = quantization(value, step)
+        if quantized is not None:
+            offset, step = quantized
+            counts, levels = quantized_levels(value, offset, step)
+            residuals = bit_difference(value, levels)
+            if not residuals.any():
+                residuals = None
+            return counts.astype(np.int64), dict(mode='quantized', offset=offset, step=step), residuals
+        return value.view('i{}'.format(value.dtype.itemsize)).astype(np.int64), dict(mode='bits'), None
+    elif value.dtype.kind == 'u' and value.dtype.itemsize == 8:
+        return value.view(np.int64), dict(mode='integer'), None
+    elif value.dtype.kind in 'biu':
+        return value.astype(np.int64), dict(mode='integer'), None
+    else:
+        raise TypeError('Data type {} cannot be encoded'.format(value.dtype))
+
+def from_counts(counts, info):
+    dtype = np.dtype(info['dtype'])
+    if info['mode'] == 'quantized':
+        return (info['offset'] + counts*info['step']).astype(dtype)
+    elif info['mode'] == 'bits':
+        return counts.astype('i{}'.format(dtype.itemsize)).view(dtype)
+    elif dtype.kind == 'u' and dtype.itemsize == 8:
+        return counts.view(dtype)
+    else:
+        return counts.astype(dtype)
+
+def pack(values, level):
+    '''
+    Zigzag encoding, byte shuffling and compression of int64 values, per chunk.
+    Returns the list of compressed chunks and the number of bytes per value.
+    '''
+    # Zigzag encoding: small negative and positive numbers give small unsigned numbers
+    zigzag = (values << 1) ^ (values >> 63)
+    zigzag = zigzag.view(np.uint64)
+    largest = int(zigzag.max()) if zigzag.size > 0 else 0
+    width = [w for w in widths if largest < 2**(8*w)][0]
+    packed = zigzag.astype('<u{}'.format(width))
+
+    chunks = []
+    for start in range(0, len(packed), chunk_size):
+        shuffled = packed[start:start+chunk_size].view(np.uint8).reshape(-1, width).T
+        chunks.append(zlib.compress(shuffled.tobytes(), level))
+    return chunks, width
+
+def unpack(data, lengths, width, n, size):
+    '''
+    Decodes n int64 values packed by `pack` (compressed chunks of `size` values with given lengths).
+    '''
+    zigzag = np.empty(n, dtype=np.uint64)
+    position = 0
+    for k, length in enumerate(lengths):
+        shuffled = np.frombuffer(zlib.decompress(data[position:position+length]), dtype=np.uint8)
+        m = len(shuffled) // width
+        zigzag[k*size:k*size+m] = shuffled.reshape(width, m).T.copy().view('<u{}'.format(width)).ravel()
+        position += length
+    return (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+
+def delta_encode(value, step=None, level=1):
+    '''
+    Encodes an array losslessly.
+
+    Parameters
+    ----------
+    value : array (float, integer or boolean)
+    step : quantization step of float arrays (e.g. ADC resolution divided by gain).
+           If it does not match, or is not given, it is estimated from the values.
+    level : zlib compression level
+
+    Returns
+    -------
+    The compressed bytes (as a uint8 array) and a description of the encoding (JSON string).
+    '''
+    value = np.asarray(value)
+    counts, info, residuals = to_counts(value, step)
+    info.update(dtype=value.dtype.str, shape=list(value.shape))
+
+    # Differences along the last axis, with the first count of each row
+    if value.ndim > 0 and value.size > 0:
+        counts = counts.reshape(-1, value.shape[-1])
+        deltas = counts.copy()
+        deltas[:, 1:] = np.diff(counts, axis=1)
+        deltas = deltas.ravel()
+    else:
+        deltas = counts
+
+    chunks, width = pack(deltas, level)
+    info.update(width=width, chunks=[len(chunk) for chunk in chunks], chunk_size=chunk_size)
+    if residuals is not None:
+        residual_chunks, residual_width = pack(residuals, level)
+        info.update(residual_width=residual_width, residual_chunks=[len(chunk) for chunk in residual_chunks])
+        chunks += residual_chunks
+    return np.frombuffer(b''.join(chunks), dtype=np.uint8), json.dumps(info)
+
+def delta_decode(data, info):
+    '''
+    Decodes an array encoded by `delta_encode`.
+
+    Parameters
+    ----------
+    data : compressed bytes (uint8 array)
+    info : description of the encoding (JSON string)
+    '''
+    if not isinstance(info, dict):
+        info = json.loads(str(info))
+    data = np.asarray(data).tobytes()
+    shape = tuple(info['shape'])
+    n = int(np.prod(shape))
+    deltas = unpack(data, info['chunks'], info['width'], n, info['chunk_size'])
+    if len(shape) > 0 and n > 0:
+        counts = np.cumsum(deltas.reshape(-1, shape[-1]), axis=1)
+    else:
+        counts = deltas
+    value = from_counts(counts.ravel(), info)
+    if 'residual_chunks' in info:
+        residuals = unpack(data[sum(info['chunks']):], info['residual_chunks'], info['residual_width'], n,
+                           info['chunk_size'])
+        size = value.dtype.itemsize
+        unsigned = value.view('u{}'.format(size))
+        unsigned += residuals.astype('i{}'.format(size)).view('u{}'.format(size))
+    return value.reshape(shape)
@@ -0,0 +1,213 @@
+'''
+Appendable session container: a directory of .npy chunks with a JSON manifest.
+'''
+from future.utils import iteritems
+import json
+import os
+import numpy as np
+
+__all__ = ['SessionContainer', 'is_container']
+
+manifest_name = 'manifest.json'
+
+def is_container(path):
+    '''
+    Returns True if `path` is a session container directory.
+    '''
+    return os.path.isfile(os.path.join(path, manifest_name))
+
+class SessionContainer(object):
+    '''
+    A session stored as a directory of chunks, to which trials are appended.
+
+    Each signal is stored in .npy files of `chunk_size` trials (memory-mapped),
+    and a manifest (manifest.json) records the data type, shape and number of trials of each signal.
+    Signals are appended independently; scalars (e.g. acquisition time) are stored as one value per trial.
+    The manifest is replaced atomically after each append, so that the container remains
+    readable if the recording is interrupted.
+
+    Example
+    -------
+    container = SessionContainer('data/session')
+    for ampli in amplitudes:
+        board.acquire('V', Ic=Ic*ampli, save=container)
+    container.close()
+    V = load_dataset('data/session', trials=slice(0, 10))['V']
+    '''
+    def __init__(self, path, mode='a', chunk_size=64):
+        '''
+        Parameters
+        ----------
+        path : directory of the container (created if needed, in mode 'a')
+        mode : 'a' (append, or create) or 'r' (read only)
+        chunk_size : number of trials per chunk file, for new containers
+        '''
+        if mode not in ['a', 'r']:
+            raise ValueError("Mode must be 'a' or 'r'")
+        self.path = path
+        self.mode = mode
+        self.chunks = dict() # open memory-mapped chunks (for writing), name -> (chunk number, array)
+        if is_container(path):
+            with open(os.path.join(path, manifest_name), 'r') as f:
+                self.manifest = json.load(f)
+        elif mode == 'r':
+            raise IOError('{} is not a session container'.format(path))
+        else:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.manifest = dict(format='clampy session', version=1, chunk_size=int(chunk_size), dt=None,
+                                 signals=dict())
+            self.write_manifest()
+
+    @property
+    def chunk_size(self):
+        return self.manifest['chunk_size']
+
+    @property
+    def dt(self):
+        return self.manifest['dt']
+
+    @property
+    def ntrials(self):
+        '''
+        Largest number of trials of the signals.
+        '''
+        return max([info['count'] for info in self.manifest['signals'].values()] + [0])
+
+    def keys(self):
+        return list(self.manifest['signals'].keys())
+
+    def __contains__(self, name):
+        return name in self.manifest['signals']
+
+    def __getitem__(self, name):
+        return self.read(name)
+
+    def count(self, name):
+        '''
+        Number of trials of signal `name`.
+        '''
+        return self.manifest['signals'][name]['count']
+
+    def chunk_filename(self, name, k):
+        return os.path.join(self.path, '{}.{:06d}.npy'.format(name, k))
+
+    def write_manifest(self):
+        filename = os.path.join(self.path, manifest_name)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.replace(tmp_filename, filename)
+        except AttributeError: # Python 2
+            os.rename(tmp_filename, filename)
+
+    def get_chunk(self, name, k):
+        '''
+        Returns chunk number `k` of signal `name`, memory-mapped for writing.
+        '''
+        if (name in self.chunks) and (self.chunks[name][0] == k):
+            return self.chunks[name][1]
+        self.close_chunk(name)
+        info = self.manifest['signals'][name]
+        filename = self.chunk_filename(name, k)
+        if os.path.exists(filename):
+            chunk = np.load(filename, mmap_mode='r+')
+        else:
+            chunk = np.lib.format.open_memmap(filename, mode='w+', dtype=np.dtype(info['dtype']),
+                                              shape=(self.chunk_size,)+tuple(info['shape']))
+        self.chunks[name] = (k, chunk)
+        return chunk
+
+    def close_chunk(self, name):
+        if name in self.chunks:
+            _, chunk = self.chunks.pop(name)
+            chunk.flush()
+            del chunk
+
+    def append(self, dt=None, **signals):
+        '''
+        Appends one trial of the signals.
+
+        Parameters
+        ----------
+        dt : sampling interval, stored in the manifest (optional)
+        signals : values of the signals for this trial (arrays or scalars)
+        '''
+        self.extend(dt=dt, **dict((name, np.asarray(value)[np.newaxis]) for name, value in iteritems(signals)))
+
+    def extend(self, dt=None, **signals):
+        '''
+        Appends several trials of the signals.
+
+        Parameters
+        ----------
+        dt : sampling interval, stored in the manifest (optional)
+        signals : values of the signals, as arrays with one row per trial
+        '''
+        if self.mode == 'r':
+            raise IOError('The container is read only')
+        if (dt is not None) and (self.manifest['dt'] is None):
+            self.manifest['dt'] = float(dt)
+        for name, values in iteritems(signals):
+            values = np.asarray(values)
+            if name not in self.manifest['signals']:
+                self.manifest['signals'][name] = dict(dtype=values.dtype.str, shape=list(values.shape[1:]), count=0)
+            info = self.manifest['signals'][name]
+            if tuple(info['shape']) != values.shape[1:]:
+                raise ValueError('Signal {} has shape {}, expected {}'.format(name, values.shape[1:],
+                                                                              tuple(info['shape'])))
+            position = 0
+            while position < len(values):
+                k, i = divmod(info['count'], self.chunk_size)
+                n = min(self.chunk_size - i, len(values) - position)
+                chunk = self.get_chunk(name, k)
+                chunk[i:i+n] = values[position:position+n]
+                chunk.flush()
+                info['count'] += n
+                position += n
+        self.write_manifest()
+
+    def read(self, name, trials=None):
+        '''
+        Reads the values of a signal.
+
+        Parameters
+        ----------
+        name : name of the signal
+        trials : selection of trials (slice, or list of trial numbers). All trials by default.
+
+        Returns
+        -------
+        An array with one row per trial.
+        '''
+        info = self.manifest['signals'][name]
+        count = info['count']
+        if trials is None:
+            trials = slice(None)
+        indices = np.arange(count)[trials]
+        result = np.empty((len(indices),)+tuple(info['shape']), dtype=np.dtype(info['dtype']))
+        chunk_numbers = indices // self.chunk_size
+        for k in np.unique(chunk_numbers):
+            selected = np.nonzero(chunk_numbers == k)[0]
+            if (name in self.chunks) and (self.chunks[name][0] == k):
+                chunk = self.chunks[name][1]
+            else:
+                chunk = np.load(self.chunk_filename(name, k), mmap_mode='r')
+            result[selected] = chunk[indices[selected] - k*self.chunk_size]
+        return result
+
+    def close(self):
+        '''
+        Closes the chunks open for writing.
+        '''
+        for name in list(self.chunks.keys()):
+            self.close_chunk(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,196 @@
+'''
+Conversion of data folders to .npz files.
+
+Usage:
+
+    clampy-convert source destination [-j jobs] [--no-verify] [--force]
+
+The folder tree `source` is copied to `destination`, with text data files (.txt, .txt.gz)
+converted to compressed .npz files. Text files with a header (as written by `Board.save`) give
+one array per column; text files without a header (e.g. Steps/V.txt) give a single array named
+after the file. Other files (.npz, .info, scripts...) are copied.
+Each converted file is read back and compared with the original (unless --no-verify).
+Files that are already converted (destination newer than source) are skipped,
+so that an interrupted conversion can be resumed.
+'''
+from __future__ import print_function
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+__all__ = ['convert_tree', 'convert_file', 'read_text']
+
+text_extensions = ['.txt', '.txt.gz']
+
+def text_extension(filename):
+    for ext in text_extensions:
+        if filename.endswith(ext):
+            return ext
+    return None
+
+def read_text(filename):
+    '''
+    Reads a text data file, with or without a header.
+
+    Returns
+    -------
+    A dictionary of arrays.
+    '''
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rt')
+    else:
+        f = open(filename, 'r')
+    with f:
+        variables = f.readline().split()
+    try: # no header
+        [float(x) for x in variables]
+        name = os.path.basename(filename)[:-len(text_extension(filename))]
+        return {name: np.loadtxt(filename)}
+    except ValueError:
+        values = np.loadtxt(filename, skiprows=1, ndmin=2)
+        return dict((name, values[:, i]) for i, name in enumerate(variables))
+
+def same_signals(signals1, signals2):
+    if set(signals1.keys()) != set(signals2.keys()):
+        return False
+    for name in signals1:
+        x, y = np.asarray(signals1[name]), np.asarray(signals2[name])
+        if x.shape != y.shape:
+            return False
+        if (x.dtype.kind in 'fc') and (y.dtype.kind in 'fc'): # NaNs are equal
+            if not np.array_equal(x[x == x], y[y == y]) or not np.array_equal(np.isnan(x), np.isnan(y)):
+                return False
+        elif not np.array_equal(x, y):
+            return False
+    return True
+
+def convert_file(source, destination, verify=True):
+    '''
+    Converts or copies a file.
+
+    Returns
+    -------
+    (source, status, input size, output size, error message), where status is 'converted', 'copied' or 'failed'.
+    '''
+    ext = text_extension(source)
+    size = os.path.getsize(source)
+    # Written to a temporary file, then renamed once checked, so that interrupted or failed
+    # conversions are redone
+    tmp_destination = destination + '.tmp.npz'
+    try:
+        if ext is None:
+            shutil.copy2(source, tmp_destination)
+            status = 'copied'
+            if verify and destination.endswith('.npz'):
+                with np.load(source) as data1:
+                    with np.load(tmp_destination) as data2:
+                        if not same_signals(data1, data2):
+                            raise IOError('copy differs from the original')
+        else:
+            signals = read_text(source)
+            np.savez_compressed(tmp_destination, **signals)
+            status = 'converted'
+            if verify:
+                with np.load(tmp_destination) as data:
+                    if not same_signals(signals, data):
+                        raise IOError('converted file differs from the original')
+        try:
+            os.replace(tmp_destination, destination)
+        except AttributeError: # Python 2
+            if os.path.exists(destination):
+                os.remove(destination)
+            os.rename(tmp_destination, destination)
+        return source, status, size, os.path.getsize(destination), None
+    except Exception as e:
+        for filename in [tmp_destination, destination]: # an older destination would be skipped on resume
+            if os.path.exists(filename):
+                os.remove(filename)
+        return source, 'failed', size, 0, str(e)
+
+def convert_tree(source, destination, jobs=None, verify=True, force=False, verbose=True):
+    '''
+    Copies a folder tree, converting text data files to .npz files, with a process pool.
+
+    Parameters
+    ----------
+    source : source folder
+    destination : destination folder
+    jobs : number of processes (default: number of processors)
+    verify : if True, converted files are read back and compared with the original
+    force : if True, files that are already converted are converted again
+    verbose : if True, prints progress and throughput
+
+    Returns
+    -------
+    A dictionary of statistics (number of files converted, copied, skipped, failed, bytes read and written,
+    duration), and the list of failures as (file, error message) under 'errors'.
+    '''
+    # List the files to convert
+    tasks = []
+    skipped = 0
+    for dirpath, _, filenames in os.walk(source):
+        target_dir = os.path.join(destination, os.path.relpath(dirpath, source))
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+        for name in filenames:
+            if name.endswith('.tmp.npz'): # interrupted conversion
+                continue
+            ext = text_extension(name)
+            target_name = name if ext is None else name[:-len(ext)] + '.npz'
+            source_file, target_file = os.path.join(dirpath, name), os.path.join(target_dir, target_name)
+            if (not force) and os.path.exists(target_file) and \
+                    (os.path.getmtime(target_file) >= os.path.getmtime(source_file)):
+                skipped += 1
+                continue
+            tasks.append((source_file, target_file))
+
+    # Convert
+    stats = dict(converted=0, copied=0, skipped=skipped, failed=0, bytes_in=0, bytes_out=0, errors=[])
+    t_start = time.time()
+    if len(tasks) > 0:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(convert_file, source_file, target_file, verify)
+                       for source_file, target_file in tasks]
+            for n, future in enumerate(as_completed(futures)):
+                source_file, status, size_in, size_out, error = future.result()
+                stats[status] += 1
+                stats['bytes_in'] += size_in
+                stats['bytes_out'] += size_out
+                if error is not None:
+                    stats['errors'].append((source_file, error))
+                    if verbose:
+                        print('Failed: {} ({})'.format(source_file, error))
+                if verbose and ((n+1) % 100 == 0):
+                    elapsed = time.time() - t_start
+                    print('{}/{} files, {:.1f} MB/s'.format(n+1, len(tasks), stats['bytes_in']/elapsed/1e6))
+    stats['duration'] = time.time() - t_start
+
+    if verbose:
+        print('{converted} converted, {copied} copied, {skipped} skipped, {failed} failed'.format(**stats))
+        if stats['duration'] > 0:
+            print('{:.1f} files/s, {:.1f} MB/s read, size ratio {:.2f}'.format(
+                len(tasks)/stats['duration'], stats['bytes_in']/stats['duration']/1e6,
+                stats['bytes_out']/float(max(stats['bytes_in'], 1))))
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='clampy-convert',
+                                     description='Copies a data folder, converting text data files to .npz files.')
+    parser.add_argument('source', help='source folder')
+    parser.add_argument('destination', help='destination folder')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes')
+    parser.add_argument('--no-verify', action='store_true', help='do not compare converted files with the originals')
+    parser.add_argument('--force', action='store_true', help='convert files that are already converted')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print progress')
+    args = parser.parse_args(argv)
+    stats = convert_tree(args.source, args.destination, jobs=args.jobs, verify=not args.no_verify,
+                         force=args.force, verbose=not args.quiet)
+    return 1 if stats['failed'] > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,6 @@
 Data management tools
 '''
 from future.utils import iteritems
-import collections
 import os
 import textwrap
 from datetime import datetime
@@ -25,10 +24,16 @@ import numpy as np
 import sys
 import re
 import uuid
+import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .storage import StoredData
+from .container import SessionContainer, is_container
+from .text_cache import text_cache
 
 __all__ = ['date_time', 'save_info', 'current_script', 'save_current_script',
            'current_filename', 'SessionRecorder', 'load_info', 'load_data',
-           'print_and_log', 'load_dataset']
+           'print_and_log', 'load_dataset', 'find_trials']
 
 def print_and_log(filename, s):
     '''
@@ -45,24 +50,26 @@ def date_time():
     t = datetime.now()
     return '{}.{}.{} {}.{}.{}'.format(t.day, t.month, t.year, t.hour, t.minute, t.second)
 
-def load_dataset(filename, copy_first=False, first_only=False):
+def find_trials(filename):
     '''
-    Loads a set of data files, of the form filename???.txt or .txt.gz or .npz
+    Finds the data files of a dataset, of the form filename???.txt or .txt.gz or .npz
     Assuming numbering from 0 to n, or no number at all.
 
-    If first_only is True, loads only the first trial.
+    Returns
+    -------
+    The list of file names, ordered by trial number.
     '''
     dir, name = os.path.split(filename)
     if dir == '':
         dir = '.'
-    pattern = re.compile(os.path.split(filename)[1]+r'(\d*)\.(txt|txt\.gz|npz)$')
+    pattern = re.compile(re.escape(name)+r'(\d*)\.(txt|txt\.gz|npz)$')
 
     # Determine extension and number of trials
     ntrials = -1
     ext = ''
     numbering = True
     for f in os.scandir(dir):
-        result = pattern.match(os.path.split(f.path)[1])
+        result = pattern.match(f.name)
         if result is not None:
             if result.group(1) == '':
                 n = 0
@@ -74,46 +81,122 @@ def load_dataset(filename, copy_first=False, first_only=False):
                 ext = '.'+result.group(2)
     ntrials += 1
 
-    if ntrials >0:
-        # Load files
-        all_signals = {}
-        min_size = 1e20
-        if first_only:
-            ntrials = 1
-        for i in range(ntrials):
-            if numbering:
-                signals = load_data(os.path.join(dir,name+str(i)+ext), copy_first=copy_first)
-            else:
-                signals = load_data(os.path.join(dir,name+ext), copy_first=copy_first)
-            if (len(signals['t'])<min_size):
-                min_size = len(signals['t'])
-            if i == 0:
-                all_signals = {x : [y] for x,y in signals.items() if (x is not 't') and (len(y.shape)>0)} # remove scalars
-                t = signals['t']
-            else:
-                all_signals = {x : all_signals[x]+[y] for x,y in signals.items()  if (x is not 't') and (len(y.shape)>0)}
+    if numbering:
+        return [os.path.join(dir, name+str(i)+ext) for i in range(ntrials)]
+    else:
+        return [os.path.join(dir, name+ext)]
 
-        # Cut at minimum size (trials could have different sizes)
-        all_signals['t'] = t[:min_size]
-        for key in all_signals:
-            if (key != 't'):
-                all_signals[key] = [signal[:min_size] for signal in all_signals[key]]
+def load_dataset(filename, copy_first=False, first_only=False, trials=None, channels=None, workers=None,
+                 progress=None, lazy=False, memory=256e6):
+    '''
+    Loads a set of data files, of the form filename???.txt or .txt.gz or .npz
+    Assuming numbering from 0 to n, or no number at all.
+    filename can also be a session container (see `SessionContainer`).
 
-        # Turn to arrays
-        all_signals = {x: np.array(all_signals[x]) for x, y in all_signals.items()}
+    Trials are read in parallel and copied into one preallocated (trials, samples) array per signal.
+    If trials have different sizes, signals are cut at the minimum size.
 
+    Parameters
+    ----------
+    filename : base name of the files, or session container
+    copy_first : if True, files are copied before being read
+    first_only : if True, loads only the first trial
+    trials : selection of trials (slice, or list of trial numbers)
+    channels : list of names of signals to load (default: all signals)
+    workers : number of reading threads (default: number of processors, at most 8)
+    progress : None, True to print progress, or a function called with (number of trials loaded, number of trials)
+    lazy : if True, returns a LazyDataset, which reads trials when they are accessed
+           (trials, first_only, workers and progress are then ignored)
+    memory : memory budget of the cache of a LazyDataset, in bytes
+
+    Returns
+    -------
+    A dictionary of signals, or None if there is no data.
+    '''
+    if lazy:
+        from .lazy import LazyDataset
+        return LazyDataset(filename, channels=channels, copy_first=copy_first, memory=memory)
+
+    if first_only:
+        trials = slice(0, 1)
+
+    if is_container(filename):
+        container = SessionContainer(filename, mode='r')
+        if channels is None:
+            channels = container.keys()
+        all_signals = {name: container.read(name, trials) for name in channels if name != 't'}
+        if container.dt is not None:
+            nsamples = [value.shape[-1] for value in all_signals.values() if value.ndim > 1]
+            if len(nsamples) > 0:
+                all_signals['t'] = np.arange(nsamples[0])*container.dt
         return all_signals
-    else:
+
+    filenames = find_trials(filename)
+    if trials is not None:
+        filenames = list(np.array(filenames, dtype=object)[trials])
+    ntrials = len(filenames)
+    if ntrials == 0:
         return None
+    if progress is True:
+        def progress(n, total):
+            print('Loaded {}/{} trials'.format(n, total))
+
+    # The first trial gives the signals and their shapes
+    signals = load_data(filenames[0], copy_first=copy_first)
+    if channels is None:
+        channels = [x for x in signals.keys() if x != 't']
+    t = np.asarray(signals['t'])
+    first = dict()
+    for x in channels:
+        value = np.asarray(signals[x])
+        if len(value.shape) > 0: # remove scalars
+            first[x] = value
+    all_signals = {x: np.empty((ntrials,)+value.shape, dtype=value.dtype) for x, value in iteritems(first)}
+    sizes = np.zeros(ntrials, dtype=int)
+
+    def copy_trial(i, signals):
+        # Copies a trial into the arrays, cut at the size of the first trial
+        size = len(signals['t'])
+        for x in all_signals:
+            value = np.asarray(signals[x])
+            n = min(value.shape[-1], all_signals[x].shape[-1])
+            all_signals[x][i, ..., :n] = value[..., :n]
+        sizes[i] = min(size, len(t))
+
+    def load_trial(i):
+        copy_trial(i, load_data(filenames[i], copy_first=copy_first))
+
+    copy_trial(0, signals)
+    if progress is not None:
+        progress(1, ntrials)
+    if ntrials > 1:
+        if workers is None:
+            workers = min(8, os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for n, future in enumerate(as_completed([executor.submit(load_trial, i) for i in range(1, ntrials)])):
+                future.result()
+                if progress is not None:
+                    progress(n+2, ntrials)
+
+    # Cut at minimum size (trials could have different sizes)
+    min_size = sizes.min()
+    all_signals = {x: value[..., :min_size] for x, value in iteritems(all_signals)}
+    all_signals['t'] = t[:min_size]
+
+    return all_signals
 
 def load_data(filename, copy_first=False):
     '''
     Loads a data file, .npz, or .txt or .txt.gz, with the following conventions:
     - header gives variable names (separated by spaces)
     - one column = one variable
-    Returns a dictionary of signals
+    Returns a dictionary of signals.
+    Signals of .npz files are read and decoded on access (see `StoredData`),
+    including commands stored by reference (see `WaveformStore`).
+    Text files are parsed once and then memory-mapped from a binary cache (see `TextCache`).
     '''
     _, ext = os.path.splitext(filename)
+    directory = os.path.dirname(filename) or '.'
 
     if copy_first:
         newfilename = str(uuid.uuid4())+ext
@@ -128,7 +211,7 @@ def load_data(filename, copy_first=False):
         else: # Python 3
             f = gzip.open(filename, mode='rt')
     elif ext == '.npz':
-        return np.load(filename)
+        return StoredData(np.load(filename), directory=directory)
     else: # assuming text
         f = open(filename, 'r')
     variables = f.readline().split()
@@ -136,7 +219,13 @@ def load_data(filename, copy_first=False):
 
     # Load signals
     signals = {}
-    for name, value in zip(variables, np.loadtxt(filename, skiprows=1, unpack=True)):
+    if copy_first: # the copy is removed, so there is no point in caching it
+        values = np.loadtxt(filename, skiprows=1)
+    else:
+        values = text_cache.load(filename, skiprows=1)
+    if values.ndim == 1:
+        values = values.reshape(-1, len(variables))
+    for name, value in zip(variables, values.T):
         signals[name] = value
 
     # Clean up
@@ -180,7 +269,7 @@ def save_info(filename, **parameters):
     _,ext = os.path.splitext(filename)
 
     with open(filename, 'w') as fp:
-        if ext == '.json':
+        if (ext == '.json') or (ext == '.info'):
             json.dump(d, fp)
         elif ext == '.yaml':
             yaml.dump(d, fp)
@@ -229,25 +318,118 @@ def save_current_script(filename = None, path = ''):
 def current_filename():
     return inspect.getfile(inspect.getmodule(inspect.currentframe(1)))
 
+class GrowableArray(object):
+    '''
+    A 2D array of fixed number of columns, to which rows are appended.
+    The capacity is doubled when needed.
+    '''
+    def __init__(self, ncolumns, dtype=np.float64, capacity=1024):
+        self.data = np.empty((capacity, ncolumns), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def new_rows(self, n):
+        '''
+        Appends `n` rows and returns them (to be filled).
+        '''
+        if self.size + n > len(self.data):
+            capacity = max(2*len(self.data), self.size + n)
+            data = np.empty((capacity, self.data.shape[1]), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        rows = self.data[self.size:self.size+n]
+        self.size += n
+        return rows
+
+    def values(self):
+        return self.data[:self.size]
+
+    def clear(self):
+        self.size = 0
+
 class SessionRecorder(object):
-    def __init__(self, basedir, dt):
+    '''
+    Records streams of values (e.g. currents, resistance, positions) during a session.
+
+    Each stream is stored as an array with one data point in each row: stimulation index,
+    time since the start of the recording, and recorded values.
+    Points are kept in NumPy buffers and appended periodically, on a background thread,
+    to a session container (see `SessionContainer`) named recording_<start time>,
+    so that at most `flush_interval` seconds of data are lost if the process dies.
+    When the recording stops, the streams are also saved as a .npz file (unless npz is False).
+    '''
+    def __init__(self, basedir, dt, flush_interval=5., npz=True):
+        '''
+        Parameters
+        ----------
+        basedir : directory of the recordings
+        dt : sampling interval
+        flush_interval : interval between writes to disk, in second
+        npz : if True, the recording is also saved as a .npz file when it stops
+        '''
         self.dt = float(dt)
         self.basedir = basedir
         if not os.path.exists(self.basedir):
             os.makedirs(self.basedir)
         self.start_time_real = None
         self.start_time_counter = None
-        self.recordings = collections.defaultdict(list)
+        self.flush_interval = flush_interval
+        self.npz = npz
+        self.buffers = dict() # name -> GrowableArray
+        self.lock = threading.Lock()
+        self.container = None
+        self.flush_thread = None
+        self.stopped = threading.Event()
 
     def start_recording(self):
         self.start_time_real = datetime.now()
         self.start_time_counter = time.time()
+        formatted_time = self.start_time_real.strftime('%H:%M:%S')
+        self.basename = 'recording_' + formatted_time
+        self.container = SessionContainer(os.path.join(self.basedir, self.basename), chunk_size=65536)
+        self.buffers = dict()
+        self.stopped.clear()
+        self.flush_thread = threading.Thread(target=self.flush_periodically, name='SessionRecorder')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+        atexit.register(self.stop_recording)
+
+    def flush_periodically(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        '''
+        Appends the buffered points to the container.
+        '''
+        with self.lock:
+            values = dict()
+            for name, buffer in iteritems(self.buffers):
+                if len(buffer) > 0:
+                    values[name] = buffer.values().copy()
+                    buffer.clear()
+        if len(values) > 0:
+            self.container.extend(dt=self.dt, **values)
 
     def stop_recording(self):
-        formatted_time = self.start_time_real.strftime('%H:%M:%S')
-        basename = 'recording_' + formatted_time
-        dict_of_arrays = {name: np.array(list(zip(*values)))
-                          for name, values in self.recordings.items()}
+        if self.container is None:
+            return
+        try:
+            atexit.unregister(self.stop_recording)
+        except AttributeError: # Python 2
+            pass
+        self.stopped.set()
+        self.flush_thread.join()
+        self.flush()
+        container, self.container = self.container, None
+        container.close()
+        if not self.npz:
+            return
+
+        basename = self.basename
+        dict_of_arrays = {name: container.read(name) for name in container.keys()}
         np.savez_compressed(os.path.join(self.basedir, basename + '.npz'),
                             **dict_of_arrays)
         with open(os.path.join(self.basedir, basename + '_info.txt'),
@@ -259,6 +441,7 @@ class SessionRecorder(object):
             Start of recording: {start}
 
             Each array in "{fname}" stores one data point in each row.
+            The same arrays are stored in the session container "{basename}".
             The first column stores an increasing index that enumerates all stimulations.
             In general this counter  does not start at 0, because it includes repetitions
             before the start of the recording. The second column stores the time in seconds 
@@ -266,7 +449,7 @@ class SessionRecorder(object):
 
             Recorded data:
             ~~~~~~~~~~~~~~
-            '''.format(fname=basename + '.npz',
+            '''.format(fname=basename + '.npz', basename=basename,
                        start=self.start_time_real.strftime('%c')))
             f.write(header + '\n')
             for name, values in sorted(dict_of_arrays.items()):
@@ -275,10 +458,26 @@ class SessionRecorder(object):
                                                values.shape[1]))
 
     def record(self, name, sample, sample_start, *value_args):
-        if name not in self.recordings:
-            self.recordings[name] = [[] for _ in range(2 + len(value_args))]
-        time_points = (sample_start - self.start_time_counter) + np.arange(len(value_args[0])) * self.dt
-        self.recordings[name][0].extend([sample] * len(time_points))
-        self.recordings[name][1].extend(time_points)
-        for value_idx, values in enumerate(value_args):
-            self.recordings[name][2 + value_idx].extend(values)
+        '''
+        Records values of a stream.
+
+        Parameters
+        ----------
+        name : name of the stream
+        sample : stimulation index
+        sample_start : time of the first value (as given by time.time())
+        value_args : arrays of values (one per column), sampled at dt
+        '''
+        n = len(value_args[0])
+        with self.lock:
+            if name not in self.buffers:
+                self.buffers[name] = GrowableArray(2 + len(value_args))
+            buffer = self.buffers[name]
+            if buffer.data.shape[1] != 2 + len(value_args):
+                raise ValueError('Stream {} has {} columns, not {}'.format(name, buffer.data.shape[1]-2,
+                                                                           len(value_args)))
+            rows = buffer.new_rows(n)
+            rows[:, 0] = sample
+            rows[:, 1] = (sample_start - self.start_time_counter) + np.arange(n) * self.dt
+            for value_idx, values in enumerate(value_args):
+                rows[:, 2 + value_idx] = values
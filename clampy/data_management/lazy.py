@@ -0,0 +1,170 @@
+'''
+Lazy loading of datasets: trials and signals are read when they are accessed.
+'''
+import collections
+import threading
+import numpy as np
+from .container import SessionContainer, is_container
+from .data_management import find_trials, load_data
+
+__all__ = ['LazyDataset', 'LazySignal']
+
+class LazySignal(object):
+    '''
+    An array-like view on a signal of a LazyDataset, of shape (trials, samples).
+    Indexing reads only the requested trials; the full array is read with `np.asarray`.
+
+    Example
+    -------
+    V = dataset['V']
+    V[10:20, :1000] # trials 10 to 19, first 1000 samples
+    '''
+    def __init__(self, dataset, name, trial_shape, dtype):
+        self.dataset = dataset
+        self.name = name
+        self.shape = (dataset.ntrials,) + tuple(trial_shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        trials, samples = key[0], key[1:]
+        indices = np.arange(self.shape[0])[trials]
+        if np.ndim(indices) == 0: # single trial
+            return np.asarray(self.dataset.read_trial(self.name, int(indices))[samples])
+        values = [self.dataset.read_trial(self.name, i)[samples] for i in indices]
+        if len(values) == 0:
+            return np.empty((0,) + np.empty(self.shape[1:])[samples].shape, dtype=self.dtype)
+        return np.array(values)
+
+    def __array__(self, dtype=None, copy=None):
+        value = self[:]
+        if dtype is not None:
+            value = value.astype(dtype)
+        return value
+
+    def __repr__(self):
+        return '<LazySignal {}, shape {}>'.format(self.name, self.shape)
+
+class LazyDataset(object):
+    '''
+    A dataset (set of trial files, or session container) whose signals are read on demand.
+    It behaves as a dictionary of signals, which are LazySignal objects (except 't').
+
+    Decoded trials are kept in a least-recently-used cache, within a memory budget.
+    Trials of .npz files are read member by member; text files are read as a whole.
+    Session containers are memory-mapped, so that only the requested samples are read.
+    Trials are assumed to have the size of the first trial.
+    '''
+    def __init__(self, filename, channels=None, copy_first=False, memory=256e6):
+        '''
+        Parameters
+        ----------
+        filename : base name of the files, or session container (see `load_dataset`)
+        channels : list of names of signals (default: all signals)
+        copy_first : if True, files are copied before being read
+        memory : memory budget of the cache, in bytes
+        '''
+        self.copy_first = copy_first
+        self.memory = memory
+        self.cache = collections.OrderedDict() # (name, trial) -> array
+        self.cache_size = 0
+        self.lock = threading.Lock()
+        self.signals = dict()
+
+        if is_container(filename):
+            self.container = SessionContainer(filename, mode='r')
+            self.filenames = None
+            self.ntrials = self.container.ntrials
+            self.chunks = dict() # memory-mapped chunks
+            if channels is None:
+                channels = self.container.keys()
+            for name in channels:
+                info = self.container.manifest['signals'][name]
+                self.signals[name] = LazySignal(self, name, info['shape'], info['dtype'])
+            nsamples = [signal.shape[-1] for signal in self.signals.values() if signal.ndim > 1]
+            if (self.container.dt is not None) and len(nsamples) > 0:
+                self.t = np.arange(nsamples[0]) * self.container.dt
+            else:
+                self.t = None
+        else:
+            self.container = None
+            self.filenames = find_trials(filename)
+            self.ntrials = len(self.filenames)
+            if self.ntrials == 0:
+                raise IOError('No data file for {}'.format(filename))
+            signals = load_data(self.filenames[0], copy_first=copy_first)
+            self.t = np.asarray(signals['t'])
+            if channels is None:
+                channels = [name for name in signals.keys() if name != 't']
+            for name in channels:
+                value = np.asarray(signals[name])
+                if value.ndim > 0: # remove scalars
+                    self.signals[name] = LazySignal(self, name, value.shape, value.dtype)
+                    self.add_to_cache(name, 0, value)
+
+    def keys(self):
+        names = list(self.signals.keys())
+        if self.t is not None:
+            names.append('t')
+        return names
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __getitem__(self, name):
+        if (name == 't') and (self.t is not None):
+            return self.t
+        return self.signals[name]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def add_to_cache(self, name, i, value):
+        with self.lock:
+            if (name, i) in self.cache:
+                return
+            self.cache[(name, i)] = value
+            self.cache_size += value.nbytes
+            # Evict the least recently used trials
+            while (self.cache_size > self.memory) and (len(self.cache) > 1):
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_size -= evicted.nbytes
+
+    def read_trial(self, name, i):
+        '''
+        Returns trial `i` of signal `name` (memory-mapped for containers).
+        '''
+        if self.container is not None:
+            k, row = divmod(i, self.container.chunk_size)
+            if (name, k) not in self.chunks:
+                self.chunks[(name, k)] = np.load(self.container.chunk_filename(name, k), mmap_mode='r')
+            return self.chunks[(name, k)][row]
+        with self.lock:
+            if (name, i) in self.cache:
+                value = self.cache.pop((name, i)) # move to the end (most recently used)
+                self.cache[(name, i)] = value
+                return value
+        signals = load_data(self.filenames[i], copy_first=self.copy_first)
+        if isinstance(signals, dict): # text files are read as a whole: keep all signals
+            for other in self.signals:
+                self.add_to_cache(other, i, np.asarray(signals[other]))
+            value = np.asarray(signals[name])
+        else: # npz: read only this signal
+            value = np.asarray(signals[name])
+            self.add_to_cache(name, i, value)
+            signals.close()
+        if value.shape != self.signals[name].shape[1:]:
+            raise ValueError('Trial {} of {} has shape {}, expected {}'.format(i, name, value.shape,
+                                                                               self.signals[name].shape[1:]))
+        return value
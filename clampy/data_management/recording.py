@@ -0,0 +1,207 @@
+'''
+Reading recordings written by SessionRecorder, by time window or sample range.
+'''
+import os
+import numpy as np
+from .container import SessionContainer, is_container
+
+__all__ = ['RecordingReader']
+
+class RecordingReader(object):
+    '''
+    Reads the streams of a recording written by `SessionRecorder`, either the session container
+    (recording_<time> directory) or the .npz file.
+
+    Each stream is an array with one data point per row: stimulation index, time, values.
+    A time index is built for each stream when it is first accessed, so that a time window or
+    a range of stimulations is read without decoding the other streams (or, for containers,
+    the other chunks of the same stream). Streams of .npz files are decoded once, then kept in memory.
+
+    Example
+    -------
+    recording = RecordingReader('data/recording_15:30:12')
+    I = recording.window('I', 10., 20.) # points between 10 s and 20 s
+    aligned = recording.resample(['resistance', 'stage_x_y'], np.arange(0, 60, 0.1))
+    '''
+    def __init__(self, filename):
+        '''
+        Parameters
+        ----------
+        filename : session container directory or .npz file
+        '''
+        if is_container(filename):
+            self.container = SessionContainer(filename, mode='r')
+            self.data = None
+        elif os.path.splitext(filename)[1] == '.npz':
+            self.container = None
+            self.data = np.load(filename)
+        else:
+            raise IOError('{} is not a recording'.format(filename))
+        self.index = dict() # name -> (times, samples, order)
+        self.arrays = dict() # decoded streams of the .npz file, read once
+
+    def streams(self):
+        '''
+        Names of the recorded streams.
+        '''
+        if self.container is not None:
+            return self.container.keys()
+        else:
+            return list(self.data.keys())
+
+    def read_rows(self, name, rows):
+        '''
+        Reads rows of a stream (rows is a slice or an array of row numbers).
+        '''
+        if self.container is not None:
+            return self.container.read(name, rows)
+        else:
+            return self.array(name)[rows]
+
+    def array(self, name):
+        '''
+        Returns a whole stream of a .npz recording, decoded when first accessed.
+        '''
+        if name not in self.arrays:
+            self.arrays[name] = self.data[name]
+        return self.arrays[name]
+
+    def get_index(self, name):
+        '''
+        Returns the time index of a stream: times and stimulation indexes (sorted by time),
+        and the corresponding rows (None if the rows are already in time order).
+        '''
+        if name not in self.index:
+            if self.container is not None: # only the first two columns are read, chunk by chunk
+                count, chunk_size = self.container.count(name), self.container.chunk_size
+                times, samples = np.empty(count), np.empty(count)
+                for start in range(0, count, chunk_size):
+                    chunk = np.load(self.container.chunk_filename(name, start // chunk_size), mmap_mode='r')
+                    n = min(chunk_size, count - start)
+                    samples[start:start+n] = chunk[:n, 0]
+                    times[start:start+n] = chunk[:n, 1]
+                    del chunk
+            else:
+                values = self.array(name)
+                times, samples = values[:, 1], values[:, 0]
+            order = None
+            if np.any(np.diff(times) < 0):
+                order = np.argsort(times, kind='mergesort')
+                times, samples = times[order], samples[order]
+            self.index[name] = (times, samples, order)
+        return self.index[name]
+
+    def rows_between(self, name, first, last):
+        # Rows from sorted position first to last (excluded)
+        _, _, order = self.get_index(name)
+        if order is None:
+            return self.read_rows(name, slice(first, last))
+        else:
+            return self.read_rows(name, np.sort(order[first:last]))
+
+    def window(self, names, start=None, stop=None):
+        '''
+        Returns the points of streams in a time window.
+
+        Parameters
+        ----------
+        names : stream name, or list of names
+        start, stop : time window in second, since the start of the recording (stop excluded)
+
+        Returns
+        -------
+        The array of points (rows: stimulation index, time, values), or a dictionary of arrays
+        if several names are given.
+        '''
+        if isinstance(names, str):
+            return self.window([names], start, stop)[names]
+        result = dict()
+        for name in names:
+            times, _, _ = self.get_index(name)
+            first = 0 if start is None else np.searchsorted(times, start, side='left')
+            last = len(times) if stop is None else np.searchsorted(times, stop, side='left')
+            result[name] = self.rows_between(name, first, last)
+        return result
+
+    def samples(self, names, first, last):
+        '''
+        Returns the points of streams for a range of stimulation indexes.
+
+        Parameters
+        ----------
+        names : stream name, or list of names
+        first, last : first and last stimulation indexes (included)
+
+        Returns
+        -------
+        The array of points (rows: stimulation index, time, values), or a dictionary of arrays
+        if several names are given.
+        '''
+        if isinstance(names, str):
+            return self.samples([names], first, last)[names]
+        result = dict()
+        for name in names:
+            _, samples, order = self.get_index(name)
+            selected = np.nonzero((samples >= first) & (samples <= last))[0]
+            if len(selected) == 0:
+                result[name] = self.read_rows(name, slice(0, 0))
+            elif order is None and (selected[-1] - selected[0] + 1 == len(selected)): # contiguous rows
+                result[name] = self.read_rows(name, slice(selected[0], selected[-1]+1))
+            else:
+                rows = selected if order is None else np.sort(order[selected])
+                result[name] = self.read_rows(name, rows)
+        return result
+
+    def resample(self, names, times, method='linear'):
+        '''
+        Resamples the values of streams on a common time base.
+
+        Parameters
+        ----------
+        names : list of stream names
+        times : array of times in second, since the start of the recording
+        method : 'linear' (linear interpolation) or 'previous' (last value before each time,
+                 for values that change by steps, such as positions). Before the first point,
+                 values are NaN.
+
+        Returns
+        -------
+        A dictionary of arrays of values, of shape (len(times), number of values).
+        '''
+        times = np.asarray(times, dtype=float)
+        if len(times) == 0:
+            return dict((name, np.empty((0, 0))) for name in names)
+        result = dict()
+        for name in names:
+            # Only the points in the time window are read (plus one on each side)
+            index, _, _ = self.get_index(name)
+            first = max(np.searchsorted(index, times.min(), side='right') - 1, 0)
+            last = min(np.searchsorted(index, times.max(), side='left') + 1, len(index))
+            points = self.rows_between(name, first, last)
+            if len(points) > 0:
+                points = points[np.argsort(points[:, 1], kind='mergesort')]
+            point_times = points[:, 1]
+            values = np.full((len(times), points.shape[1]-2), np.nan)
+            if len(points) > 0:
+                if method == 'linear':
+                    for j in range(values.shape[1]):
+                        values[:, j] = np.interp(times, point_times, points[:, 2+j], left=np.nan, right=np.nan)
+                elif method == 'previous':
+                    k = np.searchsorted(point_times, times, side='right') - 1
+                    valid = k >= 0
+                    values[valid] = points[k[valid], 2:]
+                else:
+                    raise ValueError('Method {} is unknown'.format(method))
+            result[name] = values
+        return result
+
+    def close(self):
+        self.arrays = dict()
+        if self.data is not None:
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
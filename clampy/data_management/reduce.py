@@ -0,0 +1,196 @@
+'''
+Streaming reductions across the trials of a dataset.
+'''
+from future.utils import iteritems
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .container import SessionContainer, is_container
+
+__all__ = ['dataset_reduce', 'TrialAccumulator']
+
+reduce_ops = ['mean', 'var', 'std', 'min', 'max', 'sum', 'count']
+
+class TrialAccumulator(object):
+    '''
+    One-pass accumulator of the mean, variance, minimum and maximum over trials
+    (Welford's algorithm; partial accumulators are merged with Chan's formula).
+
+    If trials have different sizes, statistics are cut at the minimum size (last axis).
+    '''
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.M2 = None # sum of squared deviations from the mean
+        self.min = None
+        self.max = None
+
+    def cut(self, size):
+        if self.mean.shape[-1] > size:
+            self.mean, self.M2 = self.mean[..., :size], self.M2[..., :size]
+            self.min, self.max = self.min[..., :size], self.max[..., :size]
+
+    def update(self, values):
+        '''
+        Adds a block of trials (array with one row per trial).
+        '''
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        block = TrialAccumulator()
+        block.n = len(values)
+        block.mean = values.mean(axis=0, dtype=np.float64)
+        block.M2 = ((values - block.mean)**2).sum(axis=0)
+        block.min, block.max = values.min(axis=0), values.max(axis=0)
+        self.merge(block)
+
+    def merge(self, other):
+        '''
+        Merges another accumulator into this one.
+        '''
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.M2, self.min, self.max = other.n, other.mean, other.M2, other.min, other.max
+            return
+        size = min(self.mean.shape[-1], other.mean.shape[-1])
+        self.cut(size)
+        other.cut(size)
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.n / float(n))
+        self.M2 = self.M2 + other.M2 + delta**2 * (self.n * other.n / float(n))
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+    def result(self, op, ddof=0):
+        if op == 'mean':
+            return self.mean
+        elif op == 'var':
+            return self.M2 / (self.n - ddof)
+        elif op == 'std':
+            return np.sqrt(self.M2 / (self.n - ddof))
+        elif op == 'min':
+            return self.min
+        elif op == 'max':
+            return self.max
+        elif op == 'sum':
+            return self.mean * self.n
+        elif op == 'count':
+            return self.n
+        else:
+            raise ValueError('Operation {} is unknown'.format(op))
+
+def dataset_reduce(filename, signals=None, ops=('mean', 'var', 'min', 'max'), trials=None, workers=None,
+                   ddof=0, copy_first=False):
+    '''
+    Computes statistics across the trials of a dataset (files filename???.txt, .txt.gz or .npz,
+    or a session container), without loading all trials in memory.
+
+    Trials are read one at a time (or one chunk at a time for containers) and accumulated
+    in one pass, with a numerically stable algorithm. With several workers, each thread
+    accumulates a contiguous block of trials, and the partial results are merged.
+    Results are the same as statistics over the array returned by `load_dataset`
+    (up to rounding errors).
+
+    Parameters
+    ----------
+    filename : base name of the files, or session container
+    signals : list of names of signals (default: all signals)
+    ops : list of statistics: 'mean', 'var', 'std', 'min', 'max', 'sum', 'count'
+    trials : selection of trials (slice, or list of trial numbers)
+    workers : number of reading threads (default: number of processors, at most 8)
+    ddof : delta degrees of freedom for 'var' and 'std' (as in `np.var`)
+    copy_first : if True, files are copied before being read
+
+    Returns
+    -------
+    A dictionary of dictionaries of arrays, indexed by signal name then statistic,
+    e.g. `result['V']['mean']`, and the time vector under 't'. None if there is no data.
+
+    Example
+    -------
+    stats = dataset_reduce('data/trial', ['V'], ops=['mean', 'std'])
+    plot(stats['t'], stats['V']['mean'])
+    '''
+    from .data_management import find_trials, load_data
+    for op in ops:
+        if op not in reduce_ops:
+            raise ValueError('Operation {} is unknown'.format(op))
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+
+    if is_container(filename):
+        container = SessionContainer(filename, mode='r')
+        if signals is None:
+            signals = [name for name in container.keys() if name != 't']
+        indices = {name: np.arange(container.count(name)) for name in signals}
+        if trials is not None:
+            indices = {name: index[trials] for name, index in iteritems(indices)}
+        ntrials = max([len(index) for index in indices.values()] + [0])
+        if ntrials == 0:
+            return None
+
+        def accumulate(name, block):
+            # Trials are read one chunk at a time
+            accumulator = TrialAccumulator()
+            chunk_size = container.chunk_size
+            for start in range(0, len(block), chunk_size):
+                values = container.read(name, block[start:start+chunk_size])
+                if values.ndim > 1: # scalars are ignored
+                    accumulator.update(values)
+            return accumulator
+
+        jobs = [(name, block) for name in signals
+                for block in np.array_split(indices[name], min(workers, max(len(indices[name]), 1)))]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            partial = list(executor.map(lambda job: (job[0], accumulate(*job)), jobs))
+        accumulators = {name: TrialAccumulator() for name in signals}
+        for name, accumulator in partial:
+            accumulators[name].merge(accumulator)
+        accumulators = {name: accumulator for name, accumulator in iteritems(accumulators) if accumulator.n > 0}
+        t = None
+        if container.dt is not None and len(accumulators) > 0:
+            size = min([accumulator.mean.shape[-1] for accumulator in accumulators.values()])
+            t = np.arange(size)*container.dt
+    else:
+        filenames = find_trials(filename)
+        if trials is not None:
+            filenames = list(np.array(filenames, dtype=object)[trials])
+        if len(filenames) == 0:
+            return None
+
+        def accumulate(block):
+            # Trials are read one at a time
+            accumulators = dict()
+            t = None
+            for f in block:
+                data = load_data(f, copy_first=copy_first)
+                names = signals if signals is not None else [x for x in data.keys() if x != 't']
+                for name in names:
+                    value = np.asarray(data[name])
+                    if value.ndim > 0: # scalars are ignored
+                        accumulators.setdefault(name, TrialAccumulator()).update(value[np.newaxis])
+                t_trial = np.asarray(data['t'])
+                t = t_trial if (t is None or len(t_trial) < len(t)) else t
+            return accumulators, t
+
+        blocks = np.array_split(np.array(filenames, dtype=object), min(workers, len(filenames)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            partial = list(executor.map(accumulate, blocks))
+        accumulators = dict()
+        t = None
+        for block_accumulators, t_block in partial: # in trial order
+            for name, accumulator in iteritems(block_accumulators):
+                accumulators.setdefault(name, TrialAccumulator()).merge(accumulator)
+            if t_block is not None:
+                t = t_block if (t is None or len(t_block) < len(t)) else t
+
+    # Cut at minimum size (trials could have different sizes)
+    if t is not None:
+        for accumulator in accumulators.values():
+            accumulator.cut(len(t))
+    result = {name: {op: accumulator.result(op, ddof) for op in ops} for name, accumulator in iteritems(accumulators)}
+    result['t'] = t
+    return result
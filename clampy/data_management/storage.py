@@ -0,0 +1,157 @@
+'''
+Compact storage of signals: float32 or 16-bit integers with a scale and offset per signal,
+and t0/dt instead of the time array, or lossless delta compression (see `delta_encode`).
+'''
+from future.utils import iteritems
+import numpy as np
+from .waveforms import waveform_store, reference_prefix
+from .codec import delta_encode, delta_decode
+
+try:
+    from collections.abc import Mapping
+except ImportError: # Python 2
+    from collections import Mapping
+
+__all__ = ['encode_signals', 'StoredData']
+
+storage_formats = ['float64', 'float32', 'int16', 'delta']
+
+def encode_signals(signals, storage='float64', t0=0., dt=None, steps=None):
+    '''
+    Encodes signals for compact storage.
+    Float arrays are converted to float32, or to int16 with a scale and offset (stored as
+    scale_<name> and offset_<name>) mapping the range of the signal onto the full integer range.
+    Scalars, integer and boolean arrays are unchanged.
+    With 'delta', all arrays are compressed losslessly (stored as delta_<name> and delta_info_<name>,
+    see `delta_encode`); this includes 't', which is kept since it is compressed efficiently.
+
+    Parameters
+    ----------
+    signals : dictionary of signals
+    storage : 'float64' (unchanged), 'float32', 'int16' or 'delta'
+    t0 : time of the first sample
+    dt : sampling interval. If given, a 't' array is replaced by t0 and dt (except with 'delta').
+    steps : dictionary of quantization steps of float signals, for 'delta' (see `delta_encode`)
+
+    Returns
+    -------
+    A dictionary of encoded signals.
+    '''
+    if storage not in storage_formats:
+        raise ValueError('Storage format {} is unknown'.format(storage))
+    encoded = dict()
+    if storage == 'delta':
+        for name, value in iteritems(signals):
+            value = np.asarray(value)
+            if (value.ndim == 0) or (value.dtype.kind not in 'biuf'):
+                encoded[name] = value
+            else:
+                step = None if steps is None else steps.get(name, None)
+                encoded['delta_'+name], encoded['delta_info_'+name] = delta_encode(value, step)
+        encoded['storage'] = storage
+        return encoded
+    for name, value in iteritems(signals):
+        if (name == 't') and (dt is not None):
+            continue
+        value = np.asarray(value)
+        if (value.ndim == 0) or (value.dtype.kind != 'f') or (storage == 'float64'):
+            encoded[name] = value
+        elif (storage == 'float32') or (value.size == 0) or not np.all(np.isfinite(value)):
+            encoded[name] = value.astype(np.float32)
+        else: # int16
+            vmin, vmax = value.min(), value.max()
+            offset = (vmin + vmax)/2.
+            scale = (vmax - vmin)/65534. # 2*32767 levels
+            if scale == 0:
+                scale = 1.
+            encoded[name] = np.round((value-offset)/scale).astype(np.int16)
+            encoded['scale_'+name] = scale
+            encoded['offset_'+name] = offset
+    if dt is not None:
+        encoded['t0'] = float(t0)
+        encoded['dt'] = float(dt)
+    encoded['storage'] = storage
+    return encoded
+
+class StoredData(Mapping):
+    '''
+    A dictionary of signals read from a file (typically a NpzFile), decoded on access.
+    Encoding keys (scale_<name>, offset_<name>, delta_<name>, delta_info_<name>, t0, dt, storage)
+    are hidden, and 't' is reconstructed from t0 and dt.
+    Waveforms stored by reference (waveform_<name>, see `WaveformStore`) are read from the
+    waveform folder of `directory`.
+    Files written without encoding are read unchanged.
+    '''
+    def __init__(self, data, directory=None):
+        '''
+        Parameters
+        ----------
+        data : a dictionary-like object of stored arrays (e.g. NpzFile)
+        directory : folder of the file, where waveforms stored by reference are found
+        '''
+        self.data = data
+        self.directory = directory
+        stored = list(data.keys())
+        hidden = set()
+        self.compressed = [] # signals compressed with delta_encode
+        self.references = dict() # name -> stored key of the hash
+        if directory is not None:
+            for name in stored:
+                if name.startswith(reference_prefix) and (name[len(reference_prefix):] not in stored):
+                    hidden.add(name)
+                    self.references[name[len(reference_prefix):]] = name
+        if 'storage' in stored:
+            hidden.add('storage')
+            for name in stored:
+                if ('scale_'+name in stored) and ('offset_'+name in stored):
+                    hidden.update(['scale_'+name, 'offset_'+name])
+                if name.startswith('delta_info_') and ('delta_'+name[11:] in stored):
+                    hidden.update([name, 'delta_'+name[11:]])
+                    self.compressed.append(name[11:])
+            if ('t0' in stored) and ('dt' in stored) and ('t' not in stored):
+                hidden.update(['t0', 'dt'])
+        self.encoded = hidden
+        self.names = [name for name in stored if name not in hidden] + self.compressed + \
+                     list(self.references.keys())
+        if 'dt' in hidden:
+            self.names.append('t')
+        self.t = None
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        if (name == 't') and ('dt' in self.encoded):
+            if self.t is None:
+                nsamples = 0
+                for other in self.names:
+                    if other != 't':
+                        value = self[other]
+                        if value.ndim > 0:
+                            nsamples = value.shape[-1]
+                            break
+                self.t = float(self.data['t0']) + np.arange(nsamples)*float(self.data['dt'])
+            return self.t
+        if name in self.references:
+            return waveform_store(self.directory).get(str(self.data[self.references[name]]))
+        if name in self.compressed:
+            return delta_decode(self.data['delta_'+name], self.data['delta_info_'+name])
+        value = self.data[name]
+        if 'scale_'+name in self.encoded:
+            return value*float(self.data['scale_'+name]) + float(self.data['offset_'+name])
+        return value
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        if hasattr(self.data, 'close'):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,174 @@
+'''
+Cache of text data files as memory-mappable binary files.
+
+The first time a .txt or .txt.gz file is loaded, its content is saved as a .npy file
+in the cache directory, keyed by the path of the file, its size and modification time.
+Later loads memory-map the .npy file instead of parsing the text.
+'''
+import hashlib
+import json
+import os
+import warnings
+import numpy as np
+
+__all__ = ['TextCache', 'text_cache', 'cached_loadtxt']
+
+low_water = 0.8 # when the cache exceeds its maximum size, it is reduced to this fraction of it
+
+class TextCache(object):
+    '''
+    A cache of parsed text files.
+
+    Entries are evicted, least recently used first, when the cache exceeds `max_size` bytes.
+    The size of the cache is estimated from the entries written since the last scan of the directory,
+    so that the directory is scanned only when the estimate exceeds `max_size`.
+
+    Example
+    -------
+    text_cache.max_size = 10e9
+    V = text_cache.load('Steps/V.txt')
+    print(text_cache.size())
+    text_cache.purge()
+    '''
+    def __init__(self, directory=None, max_size=2e9):
+        '''
+        Parameters
+        ----------
+        directory : cache directory (default ~/.clampy/text_cache)
+        max_size : maximum size of the cache, in bytes
+        '''
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.clampy', 'text_cache')
+        self.directory = directory
+        self.max_size = max_size
+        self.enabled = True
+        self.estimated_size = None # size of the cache in bytes, None if unknown (scanned on next write)
+
+    def key(self, filename, skiprows):
+        return hashlib.sha1('{}:{}'.format(os.path.abspath(filename), skiprows).encode('utf-8')).hexdigest()
+
+    def load(self, filename, skiprows=0):
+        '''
+        Returns the content of a text file, as `np.loadtxt(filename, skiprows=skiprows)`,
+        memory-mapped from the cache if the file has not changed.
+        '''
+        if not self.enabled:
+            return np.loadtxt(filename, skiprows=skiprows)
+        stat = os.stat(filename)
+        key = self.key(filename, skiprows)
+        data_filename = os.path.join(self.directory, key + '.npy')
+        info_filename = os.path.join(self.directory, key + '.json')
+        source = dict(filename=os.path.abspath(filename), size=stat.st_size, mtime=stat.st_mtime)
+
+        # Cached version
+        try:
+            with open(info_filename, 'r') as f:
+                info = json.load(f)
+            if info == source:
+                value = np.load(data_filename, mmap_mode='c') # copy on write
+                os.utime(data_filename, None) # last access, for eviction
+                return value
+        except (IOError, OSError, ValueError): # not in the cache, or invalid entry
+            pass
+
+        # Parse and store
+        value = np.loadtxt(filename, skiprows=skiprows)
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            replaced_size = os.path.getsize(data_filename) if os.path.exists(data_filename) else 0
+            tmp_filename = data_filename + '.tmp.npy'
+            np.save(tmp_filename, value)
+            try:
+                os.replace(tmp_filename, data_filename)
+            except AttributeError: # Python 2
+                os.rename(tmp_filename, data_filename)
+            with open(info_filename, 'w') as f:
+                json.dump(source, f)
+            if self.estimated_size is None:
+                self.estimated_size = self.size()
+            else:
+                self.estimated_size += os.path.getsize(data_filename) - replaced_size
+            if self.estimated_size > self.max_size:
+                self.evict(low_water*self.max_size)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not write the text cache: {}'.format(e))
+        return value
+
+    def entries(self):
+        '''
+        Returns the list of cache entries, as (key, source filename, size in bytes, last access time),
+        least recently used first.
+        '''
+        entries = []
+        if not os.path.exists(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                data_filename = os.path.join(self.directory, name[:-5] + '.npy')
+                try:
+                    with open(os.path.join(self.directory, name), 'r') as f:
+                        source = json.load(f)['filename']
+                    stat = os.stat(data_filename)
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+                entries.append((name[:-5], source, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[3])
+
+    def size(self):
+        '''
+        Total size of the cache, in bytes.
+        '''
+        return sum([size for _, _, size, _ in self.entries()])
+
+    def remove(self, filename):
+        '''
+        Removes the entries of a source file.
+        '''
+        for key, source, _, _ in self.entries():
+            if source == os.path.abspath(filename):
+                self.remove_entry(key)
+        self.estimated_size = None
+
+    def remove_entry(self, key):
+        for ext in ['.json', '.npy']:
+            try:
+                os.remove(os.path.join(self.directory, key + ext))
+            except OSError:
+                pass
+
+    def evict(self, max_size=None):
+        '''
+        Removes the least recently used entries until the cache is smaller than `max_size`
+        (default: `self.max_size`). Entries of source files that no longer exist are removed.
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        size = 0
+        for key, source, entry_size, _ in self.entries():
+            if os.path.exists(source):
+                entries.append((key, entry_size))
+                size += entry_size
+            else:
+                self.remove_entry(key)
+        for key, entry_size in entries:
+            if size <= max_size:
+                break
+            self.remove_entry(key)
+            size -= entry_size
+        self.estimated_size = size
+
+    def purge(self):
+        '''
+        Empties the cache.
+        '''
+        self.evict(max_size=0)
+
+text_cache = TextCache()
+
+def cached_loadtxt(filename, skiprows=0):
+    '''
+    Loads a text file as `np.loadtxt`, using the text cache.
+    '''
+    return text_cache.load(filename, skiprows=skiprows)
@@ -0,0 +1,100 @@
+'''
+Storage of command waveforms by content hash.
+
+Commands that are repeated across trials (e.g. in oscilloscope or repeated protocols) are stored once
+per folder, in a `waveforms` subfolder, as <hash>.npy files. Trial files store the hash instead
+of the array, as waveform_<name>.
+'''
+import hashlib
+import os
+import threading
+import numpy as np
+
+__all__ = ['WaveformStore', 'waveform_store']
+
+waveform_folder = 'waveforms'
+reference_prefix = 'waveform_'
+
+def waveform_hash(value):
+    '''
+    Returns the content hash of an array (data type, shape and values).
+    '''
+    value = np.ascontiguousarray(value)
+    h = hashlib.sha1('{}{}'.format(value.dtype.str, value.shape).encode('utf-8'))
+    h.update(value.view(np.uint8) if value.size > 0 else b'')
+    return h.hexdigest()
+
+class WaveformStore(object):
+    '''
+    A folder of waveforms identified by their content hash.
+
+    Example
+    -------
+    store = waveform_store('data')
+    key = store.put(Ic)
+    Ic = store.get(key)
+    '''
+    def __init__(self, directory, max_cached=64):
+        '''
+        Parameters
+        ----------
+        directory : folder of the waveforms (created when the first waveform is stored)
+        max_cached : maximum number of waveforms kept in memory after they are read
+        '''
+        self.directory = directory
+        self.max_cached = max_cached
+        self.cache = dict() # loaded waveforms
+        self.lock = threading.Lock()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def put(self, value):
+        '''
+        Stores a waveform if it is not already stored, and returns its hash.
+        The file is checked each time (not cached), since the folder may be moved or deleted during a session.
+        '''
+        value = np.asarray(value)
+        key = waveform_hash(value)
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            if not os.path.exists(self.directory):
+                try:
+                    os.makedirs(self.directory)
+                except OSError: # created by another thread or process
+                    pass
+            tmp_filename = '{}.{}.tmp.npy'.format(filename[:-4], threading.current_thread().ident)
+            np.save(tmp_filename, value)
+            try:
+                os.replace(tmp_filename, filename)
+            except AttributeError: # Python 2
+                os.rename(tmp_filename, filename)
+        return key
+
+    def get(self, key):
+        '''
+        Returns the waveform with hash `key` (read-only array, shared between trials).
+        '''
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+        value = np.load(self.filename(key))
+        value.flags.writeable = False
+        with self.lock:
+            if len(self.cache) >= self.max_cached:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = value
+        return value
+
+stores = dict()
+stores_lock = threading.Lock()
+
+def waveform_store(directory):
+    '''
+    Returns the waveform store of a data folder (shared by all users of the folder).
+    '''
+    path = os.path.abspath(os.path.join(directory, waveform_folder))
+    with stores_lock:
+        if path not in stores:
+            stores[path] = WaveformStore(path)
+        return stores[path]
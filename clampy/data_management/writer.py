@@ -0,0 +1,134 @@
+'''
+Background writing of data files
+'''
+import atexit
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+__all__ = ['BackgroundWriter']
+
+class BackgroundWriter(object):
+    '''
+    Writes files on a background thread, so that serialization and compression
+    do not delay the acquisition.
+
+    Write requests are put in a bounded queue. The arrays are passed by reference (not copied),
+    so they should not be modified until they are written. When the queue is full,
+    `submit` blocks until a file is written (backpressure).
+    Pending files are written when the program exits.
+
+    Example
+    -------
+    board.writer = BackgroundWriter()
+    V = board.acquire('V', Ic=Ic, save='trial.npz') # returns before the file is written
+    board.writer.flush()
+    print(board.writer.stats())
+    '''
+    def __init__(self, maxsize=8):
+        '''
+        Parameters
+        ----------
+        maxsize : maximum number of pending files
+        '''
+        self.queue = queue.Queue(maxsize)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.errors = []
+        # Statistics
+        self.nfiles = 0
+        self.nbytes = 0
+        self.write_time = 0. # time spent writing, in second
+        self.wait_time = 0. # time spent waiting for the queue, in second
+        self.max_pending = 0
+
+    def start(self):
+        '''
+        Starts the writing thread (done automatically on the first write request).
+        '''
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='BackgroundWriter')
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None: # stop
+                    return
+                function, filename, args, kwd = item
+                t1 = time.time()
+                try:
+                    function(filename, *args, **kwd)
+                except Exception as e:
+                    with self.lock:
+                        self.errors.append((filename, e))
+                    continue
+                t2 = time.time()
+                with self.lock:
+                    self.nfiles += 1
+                    self.write_time += t2-t1
+                    try:
+                        self.nbytes += os.path.getsize(filename)
+                    except (TypeError, OSError): # not a file
+                        pass
+            finally:
+                self.queue.task_done()
+
+    def submit(self, function, filename, *args, **kwd):
+        '''
+        Requests a call to `function(filename, *args, **kwd)` on the writing thread.
+        Blocks if the queue is full.
+        '''
+        self.start()
+        t1 = time.time()
+        self.queue.put((function, filename, args, kwd))
+        with self.lock:
+            self.wait_time += time.time()-t1
+            self.max_pending = max(self.max_pending, self.queue.qsize())
+
+    def flush(self):
+        '''
+        Waits until all pending files are written.
+        Raises an IOError if some files could not be written.
+        '''
+        if self.thread is not None:
+            self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if len(errors) > 0:
+            raise IOError('Could not write {} file(s): '.format(len(errors)) +
+                          ', '.join(['{} ({})'.format(filename, e) for filename, e in errors]))
+
+    def close(self):
+        '''
+        Writes pending files and stops the writing thread.
+        '''
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            try:
+                atexit.unregister(self.close)
+            except AttributeError: # Python 2
+                pass
+        self.flush()
+
+    def stats(self):
+        '''
+        Returns a dictionary of writing statistics: number of files and bytes written,
+        time spent writing and waiting for the queue (in second), throughput (in bytes/s),
+        maximum number of pending files.
+        '''
+        with self.lock:
+            return dict(files=self.nfiles, bytes=self.nbytes, write_time=self.write_time,
+                        wait_time=self.wait_time,
+                        throughput=self.nbytes/self.write_time if self.write_time > 0 else 0.,
+                        max_pending=self.max_pending, pending=self.queue.qsize())
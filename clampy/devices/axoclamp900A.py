@@ -202,6 +202,8 @@ class AxoClamp900A(object):
         self.first_headstage_type = ctypes.c_uint(20)
         self.second_headstage_type = ctypes.c_uint(20)
         self.current_mode = [0,0]
+        self.scaled_output_signal = [None, None] # last selected signals
+        self.boards = [] # boards whose gain caches depend on this amplifier
         self.check_error(fail=True)
         self.select_amplifier()
         self.serial = None
@@ -239,6 +241,17 @@ class AxoClamp900A(object):
         for name, ID in zip(names, range(18)):
             board.set_virtual_input(name, channel=(scaled_output1, scaled_output2), deviceID=ID,
                                     select=self.set_scaled_output_signal)
+        if board not in self.boards:
+            self.boards.append(board)
+
+    def invalidate_gains(self):
+        '''
+        Invalidates the gain caches of the boards connected to the amplifier.
+        Called when the mode, scaled output signals or gains change.
+        '''
+        self.scaled_output_signal = [None, None] # signals may differ between modes
+        for board in self.boards:
+            board.invalidate_gains()
 
     def get_scaled_signal_gain(self, signal):
         '''
@@ -341,6 +354,7 @@ class AxoClamp900A(object):
         if not self.dll.AXC_Reset(self.msg_handler,
                                   ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
 
     def set_cache_enable(self, enable):
         if not self.dll.AXC_SetCacheEnable(self.msg_handler,
@@ -1395,6 +1409,9 @@ class AxoClamp900A(object):
                                                   ctypes.c_uint(mode),
                                                   ctypes.byref(self.last_error)):
             self.check_error()
+        if signal != self.scaled_output_signal[channel]:
+            self.invalidate_gains()
+            self.scaled_output_signal[channel] = signal
 
     def get_scaled_output_signal(self, channel, mode=None):
         if mode is None:
@@ -1419,6 +1436,7 @@ class AxoClamp900A(object):
                                                 ctypes.c_uint(mode),
                                                 ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
 
     def get_scaled_output_signal_gain(self, channel, mode=None):
         gain = ctypes.c_double(0.)
@@ -1662,6 +1680,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_ICLAMP),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
         self.set_external_command_enable(True, channel)
 
     def DCC(self):
@@ -1672,6 +1691,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_DCC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
         self.set_external_command_enable(True, 0)
 
     def dSEVC(self):
@@ -1682,6 +1702,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_DSEVC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
         self.set_external_command_enable(True, 0)
 
     def HVIC(self):
@@ -1692,6 +1713,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_HVIC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
         self.set_external_command_enable(True, 1)
 
     def TEVC(self):
@@ -1703,6 +1725,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_TEVC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
         self.set_external_command_enable(True, 1)
 
     def I0(self, channel):
@@ -1713,6 +1736,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_IZERO),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.invalidate_gains()
 
     def get_meter_value(self, channel):
         value = ctypes.c_double(0.)
@@ -14,8 +14,12 @@ import numpy as np
 import time
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from ..data_management.storage import encode_signals
+from ..data_management.container import SessionContainer
+from ..data_management.waveforms import waveform_store
 
-__all__ = ['Board']
+__all__ = ['Board', 'AcquisitionPlan']
 
 class Board:
     '''
@@ -35,6 +39,15 @@ class Board:
         self.select_function = dict() # signal selection function for virtual channels
         self.alias = dict() # dictionary of aliases (mapping from alias to channel name)
         self.sampling_rate = None # could be a property
+        self.cache_gains = False # if True, gains are kept across acquisitions until invalidated
+        self.gain_cache = dict()
+        self.configuration_version = 0 # incremented when acquisition plans become invalid
+        self.executor = None # acquisition thread, for asynchronous acquisitions
+        self.writer = None # if set (e.g. to a BackgroundWriter), files are saved in the background
+        self.storage = 'float64' # storage of signals in .npz files: 'float64', 'float32', 'int16' or 'delta'
+        self.deduplicate = False # if True, commands are stored once per folder in .npz files (see `WaveformStore`)
+        self.input_resolution = None # quantization step of raw analog inputs in volt (e.g. 20./65536 for 16 bits
+                                     # on +-10 V), used by 'delta' storage
         self.reset_clock()
 
     def reset_clock(self):
@@ -60,6 +73,7 @@ class Board:
         self.deviceID[name] = deviceID
         self.min[name] = min
         self.max[name] = max
+        self.invalidate_gains()
 
     def set_analog_output(self, name, channel=None, gain=None, deviceID=None):
         '''
@@ -77,6 +91,7 @@ class Board:
         self.analog_output[name] = channel
         self.gain[name] = gain
         self.deviceID[name] = deviceID
+        self.invalidate_gains()
 
     def set_digital_input(self, name, channel=None, deviceID=None):
         '''
@@ -90,6 +105,7 @@ class Board:
         '''
         self.digital_input[name] = channel
         self.deviceID[name] = deviceID
+        self.invalidate_gains()
 
     def set_digital_output(self, name, channel=None, deviceID=None):
         '''
@@ -103,6 +119,7 @@ class Board:
         '''
         self.digital_output[name] = channel
         self.deviceID[name] = deviceID
+        self.invalidate_gains()
 
     def set_virtual_input(self, name, channel = None, deviceID=None, select=None):
         '''
@@ -118,6 +135,7 @@ class Board:
         self.virtual_input[name] = channel
         self.select_function[name] = select
         self.deviceID[name] = deviceID
+        self.invalidate_gains()
 
     def set_virtual_output(self, name, channel = None, deviceID=None, select=None):
         '''
@@ -133,6 +151,7 @@ class Board:
         self.virtual_output[name] = channel
         self.select_function[name] = select
         self.deviceID[name] = deviceID
+        self.invalidate_gains()
 
     def set_aliases(self, **aliases):
         '''
@@ -144,6 +163,7 @@ class Board:
         '''
         for alias, channel in iteritems(aliases):
             self.alias[alias] = channel
+        self.invalidate_gains()
 
     def get_alias(self, alias):
         '''
@@ -168,28 +188,76 @@ class Board:
 
     def get_gain(self, name):
         '''
-        Returns the gain of the named channel
+        Returns the gain of the named channel.
+        If `cache_gains` is True, the gain is kept until `invalidate_gains` is called.
         '''
         name = self.get_alias(name)
+        if self.cache_gains and (name in self.gain_cache):
+            return self.gain_cache[name]
         deviceID = self.deviceID[name]
         if deviceID is None: # in this case the gain is a fixed number
-            return self.gain[name]
+            gain = self.gain[name]
         else: # call the device to get the gain
-            return self.gain[name](deviceID) # for virtual channels however, it should probably be the ID of the physical channel
+            gain = self.gain[name](deviceID) # for virtual channels however, it should probably be the ID of the physical channel
+        if self.cache_gains:
+            self.gain_cache[name] = gain
+        return gain
 
-    def save(self, filename, acquisition_time=None, **signals):
+    def get_gains(self, names):
+        '''
+        Returns a snapshot of the gains of the named channels, as a dictionary.
+        Each gain is resolved only once.
+        '''
+        gains = dict()
+        for name in names:
+            name = self.get_alias(name)
+            if name not in gains:
+                gains[name] = self.get_gain(name)
+        return gains
+
+    def invalidate_gains(self):
+        '''
+        Empties the gain cache and invalidates acquisition plans.
+        Amplifier drivers call this when they change mode, scaled output signals or gains.
+        '''
+        self.gain_cache.clear()
+        self.configuration_version += 1
+
+    def save(self, filename, acquisition_time=None, gains=None, commands=None, storage=None, **signals):
         '''
         Saves signals to the file `filename`.
 
         Parameters
         ----------
-        filename : name of the file. The extension should be npz.
+        filename : name of the file (the extension should be npz), or a SessionContainer,
+                   to which signals are appended as a new trial
         signals : dictionary of signals
         acquisition_time : time at acquisition start
+        gains : dictionary of gains of the signals, stored as gain_<name> (npz only)
+        commands : names of the command signals (outputs)
+        storage : storage format of .npz files (default: `self.storage`)
+
+        With storage set to 'float32' or 'int16', .npz files store signals in that format
+        (int16 with a scale and offset per signal), and t0/dt instead of t (see `encode_signals`).
+        With 'delta', signals are compressed losslessly (see `delta_encode`); the quantization step of
+        measurements is `self.input_resolution` divided by their gain, if set.
+        With `self.deduplicate` set to True, .npz files store commands by content hash, each distinct
+        command being saved once in the `waveforms` subfolder (see `WaveformStore`).
         '''
-        # Add time variable
+        if storage is None:
+            storage = self.storage
+        if isinstance(filename, SessionContainer):
+            if gains is not None:
+                for name, value in iteritems(gains):
+                    signals['gain_'+name] = value
+            if acquisition_time is not None:
+                signals['acquisition_time'] = acquisition_time
+            filename.append(dt=1./self.sampling_rate, **signals)
+            return
+
+        # Add time variable (signals can be 2D arrays of sweeps)
         one_signal = list(signals.values())[0]
-        t = np.arange(len(one_signal))/self.sampling_rate
+        t = np.arange(np.shape(one_signal)[-1])/self.sampling_rate
         signals['t'] = t
 
         # Fill in with zeros if some signals are shorter than others
@@ -205,11 +273,29 @@ class Board:
         _, ext = os.path.splitext(filename)
 
         if ext == '.npz':
-            # We could add other information, like gains etc
+            # We could add other information
             signals['acquisition_time'] = acquisition_time
+            if gains is not None:
+                for name, value in iteritems(gains):
+                    signals['gain_'+name] = value
+            if self.deduplicate and (commands is not None):
+                store = waveform_store(os.path.dirname(filename) or '.')
+                for name in commands:
+                    if name in signals:
+                        signals['waveform_'+name] = store.put(signals.pop(name))
+            steps = dict()
+            if (self.input_resolution is not None) and (gains is not None):
+                for name, gain in iteritems(gains):
+                    if (commands is None) or (name not in commands):
+                        steps[name] = self.input_resolution/gain
+            if storage != 'float64':
+                signals = encode_signals(signals, storage, dt=1./self.sampling_rate, steps=steps)
 
             f = open(filename, 'wb')
-            np.savez_compressed(f, **signals)
+            if storage == 'delta': # already compressed
+                np.savez(f, **signals)
+            else:
+                np.savez_compressed(f, **signals)
             f.close()
         elif (ext == '.gz') or (ext == '.txt'): # compressed or uncompressed text file
             variables = signals.keys()
@@ -219,58 +305,54 @@ class Board:
         else:
             raise IOError('Format .{} is unknown'.format(ext))
 
-    def save_compressed(self, filename, acquisition_time=None, **signals):
+    def store(self, filename, acquisition_time=None, gains=None, commands=None, **signals):
         '''
-        Saves signals to the file `filename`, saving the diff of signals.
-        Beware: the signals dictionary is changed in place.
+        Saves signals as `save`, on the background writer if there is one (`self.writer`).
+        In that case, the arrays are not copied and should not be modified until they are written.
+        '''
+        if self.writer is None:
+            self.save(filename, acquisition_time=acquisition_time, gains=gains, commands=commands, **signals)
+        else:
+            self.writer.submit(self.save, filename, acquisition_time=acquisition_time, gains=gains,
+                               commands=commands, **signals)
 
-        ** NOT TESTED **
+    def save_compressed(self, filename, acquisition_time=None, gains=None, commands=None, **signals):
+        '''
+        Saves signals to the file `filename` (the extension should be npz), with lossless
+        delta compression (see `delta_encode`), whatever `self.storage`.
+        The file is read by `load_data` as other files.
 
         Parameters
         ----------
         filename : name of the file. The extension should be npz.
         signals : dictionary of signals
         acquisition_time : time at acquisition start
+        gains : dictionary of gains of the signals, stored as gain_<name>
+        commands : names of the command signals (outputs)
         '''
-        # Compress signals
-        for var in signals:
-            signals[var] = np.hstack(signals[var][0],np.diff(signals[var]))
-
-        # Add time variable
-        one_signal = list(signals.values())[0]
-        t = np.arange(len(one_signal))/self.sampling_rate
-        signals['t'] = np.hstack(t[0],np.diff(t))
-        # We could other information, like gains etc
-        signals['acquisition_time'] = acquisition_time
-
-        f = open(filename, 'wb')
-        np.savez_compressed(f, **signals)
-        f.close()
+        self.save(filename, acquisition_time=acquisition_time, gains=gains, commands=commands, storage='delta',
+                  **signals)
 
-    def acquire(self, *inputs, **kwd):
+    def parse_outputs(self, kwd, keywords=()):
         '''
-        Acquires scaled signals and returns scaled measurements (with appropriate gains).
-        Also handles virtual channels.
+        Splits acquisition keywords into analog outputs, digital outputs and options.
 
         Parameters
         ----------
-        inputs : list of input names (= measurements)
-        kwd : keywords, either an output signal (key = output channel name, value = array)
-              or one of the following keywords. If the value is None, it is ignored.
-
-        save : filename to save the data
+        kwd : dictionary of keywords, either output signals (key = output channel name) or options
+        keywords : names of the options
 
         Returns
         -------
-        Values of inputs, as list of arrays or single array (if just one input).
+        analog_outputs, digital_outputs, options (dictionaries).
+        Outputs with value None are ignored.
         '''
-        # Parse keywords
-        filename = None
         analog_outputs={}
         digital_outputs={}
+        options={}
         for keyword,value in iteritems(kwd):
-            if keyword=='save':
-                filename=value
+            if keyword in keywords:
+                options[keyword]=value
             elif value is not None:
                 if self.get_alias(keyword) in self.analog_output:
                     analog_outputs[keyword]=value
@@ -278,11 +360,20 @@ class Board:
                     digital_outputs[keyword]=value
                 else:
                     raise AttributeError('{} is not an output channel'.format(keyword))
+        return analog_outputs, digital_outputs, options
 
-        # Substitute aliases
-        digital_outputs=self.substitute_aliases(digital_outputs)
+    def allocate_inputs(self, inputs):
+        '''
+        Allocates physical channels to the inputs, selecting signals of virtual channels on the devices.
 
-        # 1. Configure virtual channels
+        Parameters
+        ----------
+        inputs : list of input names
+
+        Returns
+        -------
+        analog_inputs, digital_inputs : lists of physical input names
+        '''
         # a. Dictionary of allocated channels
         all_channels = list(self.analog_input.keys()) + list(self.analog_output.keys())
         allocated=dict.fromkeys(all_channels, False)
@@ -317,78 +408,329 @@ class Board:
                 else:
                     raise AttributeError('{} is not an input'.format(I))
         # c. Virtual outputs (not considered yet)
+        return analog_inputs, digital_inputs
 
-        # 2. Get the correct gains
-        gain = dict()
-        for I in analog_inputs:
-            gain[I] = self.get_gain(I)
-        for O in analog_outputs:
-            O = self.get_alias(O)
-            gain[O] = self.get_gain(O)
+    def prepare(self, *inputs, **kwd):
+        '''
+        Prepares an acquisition that is repeated many times.
+        Channel allocation, gains and ranges are resolved once.
 
-        # 3. Check that all output arrays have the same length
-        nsamples = [len(output) for output in analog_outputs.values()]
+        Parameters
+        ----------
+        inputs : list of input names (= measurements)
+        kwd : keywords, either an output (key = output channel name, value = number of samples,
+              or an array of that length) or one of the following keywords. If the value is None, it is ignored.
+
+        dtype : data type of the returned traces (default float64; float32 halves memory use)
+        reuse_buffers : if True, the plan owns the output and trace buffers, which are overwritten
+                        by each run (default False)
+
+        Returns
+        -------
+        An AcquisitionPlan, which is run with `plan.run(**outputs)`.
+
+        Example
+        -------
+        plan = board.prepare('V', 'I', Ic=len(Ic))
+        for ampli in amplitudes:
+            V, I = plan.run(Ic=Ic*ampli)
+        '''
+        # Parse keywords
+        analog_outputs, digital_outputs, options = self.parse_outputs(kwd, keywords=['dtype', 'reuse_buffers'])
+        nsamples = [n if np.isscalar(n) else len(n) for n in list(analog_outputs.values())+list(digital_outputs.values())]
         if not all([nsample==nsamples[0] for nsample in nsamples]):
             raise Exception('Output arrays have different lengths.')
 
-        # 4. Scale output gains
-        raw_analog_outputs = dict() # maps physical channel numbers to signal waveforms
-        names, values = analog_outputs.keys(), analog_outputs.values()
-        for name, value in zip(names, values):
-            aliased_name = self.get_alias(name)
-            gain = self.get_gain(name)
-            #analog_outputs[name] = value * gain
-            raw_analog_outputs[self.analog_output[aliased_name]] = value * gain
+        # 1. Configure virtual channels
+        analog_inputs, digital_inputs = self.allocate_inputs(inputs)
 
-        raw_digital_outputs = dict()
-        for name, value in iteritems(digital_outputs):
+        # 2. Get the correct gains, once for the whole acquisition
+        gain = self.get_gains(analog_inputs + list(analog_outputs.keys()))
+
+        # 3. Map outputs to physical channels
+        outputs = dict() # maps output names to (channel number, gain), gain = None for digital outputs
+        for name in analog_outputs:
             aliased_name = self.get_alias(name)
-            raw_digital_outputs[self.digital_output[aliased_name]] = value
+            outputs[aliased_name] = (self.analog_output[aliased_name], gain[aliased_name])
+        for name in digital_outputs:
+            aliased_name = self.get_alias(name)
+            outputs[aliased_name] = (self.digital_output[aliased_name], None)
 
-        # 5. Acquire
+        # 4. Map inputs to physical channels
         input_channels = [self.analog_input[name] for name in analog_inputs]
         digital_input_channels = [self.digital_input[name] for name in digital_inputs]
         # Range of acquisition, if specified
         input_range = dict()
         for name in analog_inputs:
             if (self.min[name] is not None) and (self.max[name] is not None):
-                gain = self.get_gain(name)
-                input_range[self.analog_input[name]] = (self.min[name]*gain, self.max[name]*gain)
-        acquisition_time = time.time()-self.init_time
-        results = self.acquire_raw(analog_inputs=input_channels, analog_outputs=raw_analog_outputs,
-                                   digital_inputs=digital_input_channels,
-                                   digital_outputs=raw_digital_outputs, input_range=input_range)
-
-        # 6. Split results into analog and digital and scale input gains
-        analog_results = results[:len(analog_inputs)]
-        digital_results = results[len(analog_inputs):]
-        #scaled_results = [value/self.get_gain(name) for name,value in zip(analog_inputs,results)]
-
-        scaled_results = []
+                input_range[self.analog_input[name]] = (self.min[name]*gain[name], self.max[name]*gain[name])
+        # Position of each input in the results, and its gain
+        input_gains = []
         analog_inputs_copy = []
         analog_inputs_copy[:] = analog_inputs
+        i_analog, i_digital = 0, len(analog_inputs)
         for I in inputs:
             if I in digital_inputs:
-                scaled_results.append(digital_results.pop(0))
+                input_gains.append((i_digital, None))
+                i_digital += 1
             else:
-                scaled_results.append(analog_results.pop(0)/self.get_gain(analog_inputs_copy.pop(0)))
+                input_gains.append((i_analog, gain[analog_inputs_copy.pop(0)]))
+                i_analog += 1
+
+        return AcquisitionPlan(self, inputs, input_channels, digital_input_channels, input_range, input_gains,
+                               outputs, nsamples[0] if len(nsamples)>0 else None,
+                               dtype=options.get('dtype', None), reuse_buffers=options.get('reuse_buffers', False))
 
-        # 7. Save
+    def acquire(self, *inputs, **kwd):
+        '''
+        Acquires scaled signals and returns scaled measurements (with appropriate gains).
+        Also handles virtual channels.
+
+        Parameters
+        ----------
+        inputs : list of input names (= measurements)
+        kwd : keywords, either an output signal (key = output channel name, value = array)
+              or one of the following keywords. If the value is None, it is ignored.
+
+        save : filename to save the data
+        out : array (single input) or list of arrays to write the values of inputs into
+        dtype : data type of the returned traces, if out is not given (default float64)
+
+        Returns
+        -------
+        Values of inputs, as list of arrays or single array (if just one input).
+        '''
+        analog_outputs, digital_outputs, options = self.parse_outputs(kwd, keywords=['save', 'out', 'dtype'])
+        outputs = dict(analog_outputs)
+        outputs.update(digital_outputs)
+        plan = self.prepare(*inputs, dtype=options.pop('dtype', None), **outputs)
+        outputs.update(options)
+        return plan.run(**outputs)
+
+    def get_executor(self):
+        '''
+        Returns the acquisition thread, created on first use.
+        It has a single worker, so that acquisitions are run one at a time, in the order they are submitted.
+        '''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        return self.executor
+
+    def shutdown_async(self, wait=True):
+        '''
+        Stops the acquisition thread, after pending acquisitions are done (if `wait` is True).
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def acquire_async(self, *inputs, **kwd):
+        '''
+        Acquires scaled signals on the acquisition thread, as `acquire`.
+        Acquisitions are run in the order of the calls; the next one starts as soon as the previous one
+        is finished, so that results can be processed while the board is acquiring.
+        Output arrays are used by reference: they should not be modified until the acquisition is done.
+
+        Parameters
+        ----------
+        Same as `acquire`.
+
+        Returns
+        -------
+        A concurrent.futures.Future, whose result is the value returned by `acquire`.
+
+        Example
+        -------
+        future = board.acquire_async('V', Ic=Ic)
+        ... (do something else)
+        V = future.result()
+        '''
+        return self.get_executor().submit(self.acquire, *inputs, **kwd)
+
+    def acquire_asyncio(self, *inputs, **kwd):
+        '''
+        Same as `acquire_async`, but returns an asyncio future, to be awaited in a coroutine:
+
+        V = await board.acquire_asyncio('V', Ic=Ic)
+        '''
+        import asyncio
+        return asyncio.wrap_future(self.acquire_async(*inputs, **kwd))
+
+    def acquire_sweeps(self, *inputs, **kwd):
+        '''
+        Acquires a series of sweeps in a single hardware-timed run.
+        The sweeps are concatenated, separated by holding periods, and split after acquisition.
+
+        Parameters
+        ----------
+        inputs : list of input names (= measurements)
+        kwd : keywords, either an output signal (key = output channel name, value = list of arrays or 2D array,
+              one row per sweep; a single array is used for all sweeps) or one of the following keywords.
+              If the value is None, it is ignored.
+
+        inter_sweep_interval : duration of the holding period between sweeps, in second (default 0).
+                               Analog outputs hold the last value of the previous sweep, digital outputs are 0.
+        save : filename to save the data (sweeps are saved as 2D arrays)
+        dtype : data type of the returned traces (default float64)
+
+        Returns
+        -------
+        Values of inputs, each as an array of shape (number of sweeps, number of samples),
+        as list of arrays or single array (if just one input).
+
+        Example
+        -------
+        I = board.acquire_sweeps('I', Vc=[Vc*ampli for ampli in amplitudes], inter_sweep_interval=0.5)
+        '''
+        analog_outputs, digital_outputs, options = self.parse_outputs(kwd, keywords=['inter_sweep_interval', 'save',
+                                                                                     'dtype'])
+        interval = options.get('inter_sweep_interval', None) or 0
+        npad = int(round(float(interval * self.sampling_rate))) # dimensionless (possibly a Quantity)
+
+        # Number of sweeps and samples
+        outputs = dict(analog_outputs)
+        outputs.update(digital_outputs)
+        nsweeps = [len(value) for value in outputs.values() if np.ndim(value) == 2]
+        if len(nsweeps) == 0:
+            raise Exception('At least one output must be a list of sweeps.')
+        if not all([n == nsweeps[0] for n in nsweeps]):
+            raise Exception('Outputs have different numbers of sweeps.')
+        nsweeps = nsweeps[0]
+        sweeps = dict()
+        for name, value in iteritems(outputs):
+            if np.ndim(value) == 2:
+                sweeps[name] = [np.asarray(sweep) for sweep in value]
+            else:
+                sweeps[name] = [np.asarray(value)] * nsweeps
+        nsamples = len(list(sweeps.values())[0][0])
+        if not all([len(sweep) == nsamples for value in sweeps.values() for sweep in value]):
+            raise Exception('Output arrays have different lengths.')
+        stride = nsamples + npad
+
+        # Concatenate the sweeps, with holding periods
+        concatenated = dict()
+        for name, value in iteritems(sweeps):
+            command = np.zeros(nsweeps*stride - npad, dtype=value[0].dtype)
+            for k, sweep in enumerate(value):
+                command[k*stride:k*stride+nsamples] = sweep
+                if (name in analog_outputs) and (k < nsweeps-1):
+                    command[k*stride+nsamples:(k+1)*stride] = sweep[-1]
+            concatenated[name] = command
+
+        # Acquire
+        plan = self.prepare(*inputs, dtype=options.get('dtype', None), **concatenated)
+        acquisition_time = time.time()-self.init_time
+        results = plan.run(**concatenated)
+        if len(inputs) == 1:
+            results = [results]
+
+        # Split the sweeps
+        results = [np.array([value[k*stride:k*stride+nsamples] for k in range(nsweeps)]) for value in results]
+
+        # Save
+        filename = options.get('save', None)
         if filename is not None:
-            signals = dict()
-            for name, value in zip(inputs, scaled_results):
-                signals[name] = value
-            signals.update(analog_outputs)
-            signals.update(digital_outputs)
-            self.save(filename, acquisition_time=acquisition_time, **signals)
+            signals = dict((name, np.array(value)) for name, value in iteritems(sweeps))
+            signals.update(zip(inputs, results))
+            gains = dict(zip(inputs, [gain for _, gain in plan.input_gains]))
+            for name in analog_outputs:
+                gains[name] = plan.outputs[self.get_alias(name)][1]
+            self.store(filename, acquisition_time=acquisition_time,
+                       gains=dict((name, gain) for name, gain in iteritems(gains) if gain is not None),
+                       commands=list(sweeps.keys()), **signals)
 
-        # Return
-        if len(inputs)==1: # not a list, single element
-            return scaled_results[0]
+        if len(inputs) == 1:
+            return results[0]
         else:
-            return scaled_results
+            return results
+
+    def stream(self, *inputs, **kwd):
+        '''
+        Continuous acquisition, in chunks, with constant memory use.
+        Returns a generator of scaled measurements.
+
+        Parameters
+        ----------
+        inputs : list of input names (= measurements)
+        kwd : keywords, either an output signal (key = output channel name)
+              or one of the following keywords. If the value is None, it is ignored.
+              An output signal is either a 1D array (or list of numbers), which is regenerated cyclically,
+              or another iterable of 1D arrays of chunk_size samples (e.g. a list of chunks),
+              which is fed chunk by chunk.
+
+        chunk_size : number of samples per chunk
+        nchunks : number of chunks (default: until an output iterable is exhausted, or forever)
+        buffers : number of chunks in the ring buffer (default 2)
+        dtype : data type of the returned traces (default float64)
+
+        Returns
+        -------
+        A generator of values of inputs for each chunk, as list of arrays or single array (if just one input).
+        The arrays are views on a ring buffer, overwritten `buffers` chunks later:
+        they must be copied (or written to disk) if they are to be kept.
+
+        Example
+        -------
+        for V in board.stream('V', Ic=Ic, chunk_size=10000, nchunks=360):
+            f.write(V.tobytes())
+        '''
+        # Parse keywords
+        analog_outputs, digital_outputs, options = self.parse_outputs(kwd, keywords=['chunk_size', 'nchunks', 'buffers',
+                                                                                     'dtype'])
+        chunk_size = int(options['chunk_size'])
+        nchunks = options.get('nchunks', None)
+        nbuffers = options.get('buffers', None) or 2
+        dtype = options.get('dtype', None) or np.float64
+
+        # Configure virtual channels and get gains
+        analog_inputs, digital_inputs = self.allocate_inputs(inputs)
+        gain = self.get_gains(analog_inputs + list(analog_outputs.keys()))
+
+        # Output chunks, scaled
+        raw_analog_outputs = dict()
+        for name, value in iteritems(analog_outputs):
+            aliased_name = self.get_alias(name)
+            raw_analog_outputs[self.analog_output[aliased_name]] = output_chunks(value, chunk_size, gain[aliased_name])
+        raw_digital_outputs = dict()
+        for name, value in iteritems(digital_outputs):
+            raw_digital_outputs[self.digital_output[self.get_alias(name)]] = output_chunks(value, chunk_size, None)
+
+        # Range of acquisition, if specified
+        input_range = dict()
+        for name in analog_inputs:
+            if (self.min[name] is not None) and (self.max[name] is not None):
+                input_range[self.analog_input[name]] = (self.min[name]*gain[name], self.max[name]*gain[name])
+
+        input_channels = [self.analog_input[name] for name in analog_inputs]
+        digital_input_channels = [self.digital_input[name] for name in digital_inputs]
+        chunks = self.stream_raw(analog_inputs=input_channels, analog_outputs=raw_analog_outputs,
+                                 digital_inputs=digital_input_channels, digital_outputs=raw_digital_outputs,
+                                 input_range=input_range, chunk_size=chunk_size, nchunks=nchunks)
+
+        # Scale into the ring buffer
+        gains = [gain[name] for name in analog_inputs]
+        ring = None
+        try:
+            for k, results in enumerate(chunks):
+                if ring is None:
+                    ring = [[np.empty(chunk_size, dtype=dtype) for _ in analog_inputs] +
+                            [np.empty(chunk_size, dtype=np.asarray(value).dtype) for value in results[len(analog_inputs):]]
+                            for _ in range(nbuffers)]
+                buffer = ring[k % nbuffers]
+                for i, value in enumerate(results):
+                    if i < len(analog_inputs):
+                        np.divide(value, gains[i], out=buffer[i])
+                    else:
+                        np.copyto(buffer[i], value)
+                if len(inputs)==1:
+                    yield buffer[0]
+                else:
+                    yield list(buffer)
+        finally:
+            chunks.close()
 
-    def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={}):
+    def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={},
+                    out=None):
         '''
         Acquires raw signals in volts, not scaled.
         Virtual channels are not handled.
@@ -401,13 +743,290 @@ class Board:
         digital_inputs : list of digital input channels (indexes) (= measurements)
         digital_outputs : dictionary of digital output channels (key = output channel index, value = array)
         input_range : dictionary of (min, max) range for each input channel, in volt
+        out : list of float arrays to write analog input values into (optional)
 
         Returns
         -------
         Values for inputs as a list of arrays, first analog inputs, then digital inputs.
         '''
-        n = len(analog_outputs.values()[0])
-        return [np.ones(n) for _ in analog_inputs] # for testing purposes
+        n = len(list(analog_outputs.values())[0])
+        if out is None:
+            out = [np.empty(n) for _ in analog_inputs]
+        for value in out:
+            value[:] = 1. # for testing purposes
+        return list(out)
+
+
+    def stream_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={},
+                   chunk_size=None, nchunks=None):
+        '''
+        Continuous acquisition of raw signals in volts, not scaled, in chunks.
+        Virtual channels are not handled.
+
+        By default, acquire_raw is called for each chunk, so that there may be gaps between chunks.
+        Boards that can acquire continuously should override this method.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes) (= measurements)
+        analog_outputs : dictionary of analog output channels (key = output channel index, value = iterator over chunks)
+        digital_inputs : list of digital input channels (indexes) (= measurements)
+        digital_outputs : dictionary of digital output channels (key = output channel index, value = iterator over chunks)
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        chunk_size : number of samples per chunk
+        nchunks : number of chunks (None = until an output iterator is exhausted, or forever)
+
+        Returns
+        -------
+        A generator of values for inputs for each chunk, as a list of arrays, first analog inputs, then digital inputs.
+        '''
+        for analog_chunk, digital_chunk in zip_chunks(analog_outputs, digital_outputs, nchunks):
+            yield self.acquire_raw(analog_inputs=analog_inputs, analog_outputs=analog_chunk,
+                                   digital_inputs=digital_inputs, digital_outputs=digital_chunk,
+                                   input_range=input_range)
+
+
+
+class AcquisitionPlan(object):
+    '''
+    A prepared acquisition, returned by `Board.prepare`.
+    Channels, gains and ranges are resolved when the plan is made, so that running it only scales and moves data.
+
+    The plan cannot be modified. It becomes invalid when channels, aliases, gains or the routing
+    of amplifier outputs change; it must then be prepared again.
+    '''
+    __slots__ = ['board', 'version', 'inputs', 'input_channels', 'digital_input_channels', 'input_range',
+                 'input_gains', 'outputs', 'nsamples', 'dtype', 'input_buffers', 'output_buffers']
+
+    def __init__(self, board, inputs, input_channels, digital_input_channels, input_range, input_gains,
+                 outputs, nsamples, dtype=None, reuse_buffers=False):
+        '''
+        Parameters
+        ----------
+        board : the board
+        inputs : list of input names
+        input_channels : list of analog input channel numbers
+        digital_input_channels : list of digital input channel numbers
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        input_gains : for each input, (index in the raw results, gain), with gain = None for digital inputs
+        outputs : dictionary mapping output names to (channel number, gain), with gain = None for digital outputs
+        nsamples : number of samples
+        dtype : data type of the returned traces (default float64)
+        reuse_buffers : if True, output and trace buffers are allocated once and overwritten by each run
+        '''
+        init = lambda name, value: object.__setattr__(self, name, value)
+        init('board', board)
+        init('version', board.configuration_version)
+        init('inputs', tuple(inputs))
+        init('input_channels', tuple(input_channels))
+        init('digital_input_channels', tuple(digital_input_channels))
+        init('input_range', dict(input_range))
+        init('input_gains', tuple(input_gains))
+        init('outputs', dict(outputs))
+        init('nsamples', nsamples)
+        init('dtype', np.dtype(dtype or np.float64))
+        if reuse_buffers and (nsamples is not None):
+            init('input_buffers', [None if gain is None else np.empty(nsamples, dtype=self.dtype)
+                                   for _, gain in input_gains])
+            init('output_buffers', dict((channel, np.empty(nsamples)) for channel, gain in outputs.values()
+                                        if gain is not None))
+        else:
+            init('input_buffers', None)
+            init('output_buffers', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('AcquisitionPlan is immutable')
+
+    @property
+    def valid(self):
+        '''
+        True if the board configuration has not changed since the plan was made.
+        '''
+        return self.version == self.board.configuration_version
+
+    def run(self, **kwd):
+        '''
+        Runs the acquisition and returns scaled measurements.
+
+        Parameters
+        ----------
+        kwd : keywords, either an output signal (key = output channel name, value = array)
+              or one of the following keywords. If the value is None, it is ignored.
+
+        save : filename to save the data
+        out : array (single input) or list of arrays to write the values of inputs into
+              (default: the plan buffers if reuse_buffers was set, otherwise new arrays)
+
+        Returns
+        -------
+        Values of inputs, as list of arrays or single array (if just one input).
+        '''
+        board = self.board
+        if not self.valid:
+            raise Exception('The board configuration has changed: the acquisition must be prepared again.')
+
+        # Scale outputs
+        filename = None
+        out = None
+        raw_analog_outputs = dict()
+        raw_digital_outputs = dict()
+        analog_outputs = dict()
+        digital_outputs = dict()
+        saved_gains = dict() # gains by signal name, for saving
+        for name, value in iteritems(kwd):
+            if name == 'save':
+                filename = value
+            elif name == 'out':
+                out = value
+            elif value is not None:
+                aliased_name = board.get_alias(name)
+                if aliased_name not in self.outputs:
+                    raise AttributeError('{} is not an output of this acquisition plan'.format(name))
+                if len(value) != self.nsamples:
+                    raise Exception('Output arrays must have {} samples.'.format(self.nsamples))
+                channel, gain = self.outputs[aliased_name]
+                if gain is None:
+                    raw_digital_outputs[channel] = value
+                    digital_outputs[aliased_name] = value
+                else:
+                    if self.output_buffers is not None:
+                        raw_analog_outputs[channel] = np.multiply(value, gain, out=self.output_buffers[channel])
+                    else:
+                        raw_analog_outputs[channel] = value * gain
+                    analog_outputs[name] = value
+                    saved_gains[name] = gain
+
+        # Arrays receiving the scaled inputs
+        if out is None:
+            out = self.input_buffers
+        elif len(self.inputs) == 1:
+            out = [out]
+        raw_out = None
+        if out is not None:
+            # Raw values are written directly into float64 arrays, then scaled in place
+            raw_out = [target for target, (_, gain) in zip(out, self.input_gains) if gain is not None]
+            if not all([target.dtype == np.float64 for target in raw_out]):
+                raw_out = None
+
+        # Acquire
+        acquisition_time = time.time()-board.init_time
+        results = board.acquire_raw(analog_inputs=list(self.input_channels), analog_outputs=raw_analog_outputs,
+                                    digital_inputs=list(self.digital_input_channels),
+                                    digital_outputs=raw_digital_outputs, input_range=self.input_range, out=raw_out)
+
+        # Scale input gains
+        scaled_results = []
+        for k, (I, (i, gain)) in enumerate(zip(self.inputs, self.input_gains)):
+            if gain is None:
+                scaled_results.append(results[i])
+            else:
+                if out is not None:
+                    target = out[k]
+                    np.divide(results[i], gain, out=target)
+                elif self.dtype != np.float64:
+                    target = np.empty(len(results[i]), dtype=self.dtype)
+                    np.divide(results[i], gain, out=target)
+                else:
+                    target = results[i]/gain
+                scaled_results.append(target)
+                saved_gains[I] = gain
+
+        # Save
+        if filename is not None:
+            signals = dict()
+            for name, value in zip(self.inputs, scaled_results):
+                if (self.input_buffers is not None) and (board.writer is not None):
+                    value = value.copy() # the buffers are overwritten by the next run
+                signals[name] = value
+            signals.update(analog_outputs)
+            signals.update(digital_outputs)
+            board.store(filename, acquisition_time=acquisition_time, gains=saved_gains,
+                        commands=list(analog_outputs.keys())+list(digital_outputs.keys()), **signals)
+
+        # Return
+        if len(self.inputs)==1: # not a list, single element
+            return scaled_results[0]
+        else:
+            return scaled_results
+
+    def run_async(self, **kwd):
+        '''
+        Runs the acquisition on the board's acquisition thread (see `Board.acquire_async`).
+        If the plan reuses its buffers, the result must be processed before the next run is finished.
+
+        Returns
+        -------
+        A concurrent.futures.Future, whose result is the value returned by `run`.
+        '''
+        return self.board.get_executor().submit(self.run, **kwd)
+
+
+def scale_output(value, gain):
+    # Output values multiplied by gain, or unchanged (with their type) if gain is None
+    if gain is None:
+        return np.asarray(value)
+    return np.asarray(value) * gain
+
+def cyclic_chunks(waveform, chunk_size):
+    # The waveform is extended so that every chunk is a contiguous view
+    n = len(waveform)
+    extended = np.tile(waveform, chunk_size // n + 2)
+    position = 0
+    while True:
+        yield extended[position:position+chunk_size]
+        position = (position + chunk_size) % n
+
+def iterated_chunks(chunks, chunk_size, gain):
+    for chunk in chunks:
+        if np.shape(chunk) != (chunk_size,):
+            raise ValueError('Output chunks must be 1D arrays of {} samples.'.format(chunk_size))
+        yield scale_output(chunk, gain)
+
+def output_chunks(value, chunk_size, gain=1.):
+    '''
+    Returns an iterator over successive chunks of an output signal, multiplied by gain.
+
+    Parameters
+    ----------
+    value : a 1D array or a list of numbers, which is regenerated cyclically,
+            or any other iterable of 1D arrays of chunk_size samples (e.g. a list of chunks)
+    chunk_size : number of samples per chunk
+    gain : conversion factor, or None (digital outputs) to keep the values and their type
+    '''
+    if isinstance(value, np.ndarray):
+        if value.ndim != 1 or len(value) == 0:
+            raise ValueError('Output waveforms must be non-empty 1D arrays.')
+        return cyclic_chunks(scale_output(value, gain), chunk_size)
+    elif isinstance(value, (list, tuple)) and (len(value) > 0) and all([np.ndim(x) == 0 for x in value]):
+        return cyclic_chunks(scale_output(value, gain), chunk_size)
+    else:
+        return iterated_chunks(value, chunk_size, gain)
+
+def zip_chunks(analog_outputs, digital_outputs, nchunks=None):
+    '''
+    Iterates over chunks of several outputs together.
+
+    Parameters
+    ----------
+    analog_outputs, digital_outputs : dictionaries of iterators over chunks
+    nchunks : number of chunks (None = until an iterator is exhausted, or forever if there is no output)
+
+    Returns
+    -------
+    A generator of (analog, digital) dictionaries of chunks.
+    '''
+    k = 0
+    while (nchunks is None) or (k < nchunks):
+        analog, digital = dict(), dict()
+        try:
+            for channel, chunks in iteritems(analog_outputs):
+                analog[channel] = next(chunks)
+            for channel, chunks in iteritems(digital_outputs):
+                digital[channel] = next(chunks)
+        except StopIteration:
+            return
+        yield analog, digital
+        k += 1
 
 
 if __name__ == '__main__':
@@ -264,6 +264,7 @@ class MultiClampChannel(object):
             self.board.gain[self.command] = self.gain['Ic']
         elif outputname == 'V':
             self.board.gain[self.command] = self.gain['Vext']
+        self.board.invalidate_gains()
 
         board_inputs = ['primary', 'secondary'][:len(inputs)] # could be just secondary too
         return self.board.acquire(*board_inputs, command = outputs[outputname])
@@ -11,41 +11,59 @@ For the NI USB 6343, analog output range is +-10 V, input ranges are:
     +-0.2 V, +-1 V, +-5 V, +-10 V
 '''
 from .board import *
+from .board import zip_chunks
+from future.utils import iteritems
 import warnings
 try:
     import nidaqmx
+    import nidaqmx.stream_readers
+    import nidaqmx.stream_writers
 except ImportError:
     warnings.warn('NI-DAQmx could not be imported')
-from numpy import zeros, array
+from numpy import zeros, array, empty, ascontiguousarray, copyto, float64
 
 class NI(Board):
     def __init__(self, device_name='Dev1', automatic_range_adjustment = False):
         Board.__init__(self)
         self.name = device_name
         self.automatic_range_adjustment = automatic_range_adjustment # if True, adjusts output range automatically
+        # Cached tasks, reused as long as the acquisition layout does not change
+        self.tasks = None
+        self.task_layout = None
+        self.buffers = dict() # raw data buffers, reused between acquisitions
 
-    def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={}):
+    def get_buffer(self, name, shape):
         '''
-        Acquires raw signals in volts, not scaled.
-        Virtual channels are not handled.
+        Returns a reusable raw data buffer of the given shape.
+        '''
+        if (name not in self.buffers) or (self.buffers[name].shape != shape):
+            self.buffers[name] = empty(shape, dtype=float64)
+        return self.buffers[name]
 
-        Parameters
-        ----------
-        analog_inputs : list of analog input channels (indexes) (= measurements)
-        analog_outputs : dictionary of analog output channels (key = output channel index, value = array)
-        digital_inputs : list of digital input channels (indexes) (= measurements)
-        digital_outputs : dictionary of digital output channels (key = output channel index, value = array)
-        input_range : dictionary of (min, max) range for each input channel, in volt
+    def task_layout_key(self, analog_inputs, analog_outputs, digital_inputs, digital_outputs, input_range, nsamples):
+        '''
+        Returns a hashable description of the acquisition layout
+        (channels, ranges, clock and number of samples).
+        Tasks are reused as long as this key does not change.
+        '''
+        ai = tuple((channel, tuple(input_range.get(channel, (-5., 5.)))) for channel in analog_inputs)
+        if self.automatic_range_adjustment:
+            ao = tuple((channel, (min(value), max(value)+0.001)) for channel, value in iteritems(analog_outputs))
+        else:
+            ao = tuple(analog_outputs.keys())
+        return (self.sampling_rate, nsamples, ai, ao, tuple(digital_inputs), tuple(digital_outputs.keys()))
+
+    def create_tasks(self, analog_inputs, analog_outputs, digital_inputs, digital_outputs, input_range, nsamples,
+                     continuous=False):
+        '''
+        Creates, configures and commits the NI-DAQmx tasks for an acquisition layout.
+        If continuous is True, nsamples is the size of the buffer, and output regeneration is disabled.
 
         Returns
         -------
-        Values for inputs as a list of arrays, first analog inputs, then digital inputs.
+        A dictionary of tasks, with keys 'ai', 'di', 'ao', 'do' (only those that are needed).
         '''
         dt = 1./self.sampling_rate
-        if len(analog_outputs)>0:
-            nsamples = len(analog_outputs.values()[0])
-        else:
-            nsamples = len(digital_outputs.values()[0])
 
         # Set the clock
         if len(analog_outputs)>0:
@@ -61,6 +79,13 @@ class NI(Board):
             clock = "/" + self.name + "/di/SampleClock"
             clock_name='di'
 
+        if continuous:
+            sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS
+        else:
+            sample_mode = nidaqmx.constants.AcquisitionType.FINITE
+
+        tasks = dict()
+
         # Read task
         # Analog input
         if len(analog_inputs)>0:
@@ -72,9 +97,10 @@ class NI(Board):
                     min_val, max_val = -5., 5. # default values of add_ai_voltage_chan
                 input_task.ai_channels.add_ai_voltage_chan(self.name+"/ai"+str(channel), min_val=min_val, max_val=max_val)
             if clock_name == 'ai':
-                input_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
+                input_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples, sample_mode=sample_mode)
             else:
-                input_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
+                input_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples, sample_mode=sample_mode)
+            tasks['ai'] = input_task
 
         # Digital input
         if len(digital_inputs)>0:
@@ -83,112 +109,237 @@ class NI(Board):
                 input_task_digital.di_channels.add_di_chan(self.name+"/line"+str(channel),
                                                    line_grouping=nidaqmx.constants.LineGrouping.CHAN_PER_LINE)
             if clock_name == 'di':
-                input_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
+                input_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples, sample_mode=sample_mode)
             else:
-                input_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
+                input_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples, sample_mode=sample_mode)
+            tasks['di'] = input_task_digital
 
         # Write task
         # Analog output
         if len(analog_outputs)>0:
             output_task = nidaqmx.Task()
-            #write_data = zeros((len(analog_outputs)+len(digital_outputs),nsamples)) # perhaps should be a list instead
-            write_data = [None for _ in range(len(analog_outputs))]
-            i=0
-            for channel, value in analog_outputs.iteritems():
+            for channel, value in iteritems(analog_outputs):
                 # Range
-                if self.automatic_range_adjustment:
+                if self.automatic_range_adjustment and (value is not None):
                     min_val, max_val = min(value), max(value)+0.001 # adding 1 mV to avoid cases where min = max
                     output_task.ao_channels.add_ao_voltage_chan(self.name+"/ao"+str(channel), min_val=min_val, max_val=max_val)
                 else:
                     output_task.ao_channels.add_ao_voltage_chan(self.name + "/ao" + str(channel))
-                write_data[i]=value
-                i=i+1
             if clock_name == 'ao':
-                output_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
+                output_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples, sample_mode=sample_mode)
             else:
-                output_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
-            if i == 1:
-                output_task.write(write_data[0]) #, timeout = nidaqmx.constants.WAIT_INFINITELY
-            else:
-                output_task.write(array(write_data)) #, timeout = nidaqmx.constants.WAIT_INFINITELY
+                output_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples, sample_mode=sample_mode)
+            if continuous: # new samples must be written for each chunk
+                output_task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+            tasks['ao'] = output_task
 
         # Digital output
         if len(digital_outputs)>0:
             output_task_digital = nidaqmx.Task()
-            write_data_digital = [None for _ in range(len(digital_outputs))]
-            i = 0
-            for channel, value in digital_outputs.iteritems():
+            for channel in digital_outputs:
                 output_task_digital.do_channels.add_do_chan(self.name+"/line"+str(channel))
-                write_data_digital[i]=value
-                i=i+1
             if clock_name == 'do':
-                output_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
-            else:
-                output_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
-            if i == 1:
-                output_task_digital.write(write_data_digital[0]) #, timeout = nidaqmx.constants.WAIT_INFINITELY
+                output_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples, sample_mode=sample_mode)
             else:
-                output_task_digital.write(array(write_data_digital)) #, timeout = nidaqmx.constants.WAIT_INFINITELY
+                output_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples, sample_mode=sample_mode)
+            if continuous:
+                output_task_digital.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+            tasks['do'] = output_task_digital
 
-        if len(digital_inputs)>0:
-            input_task_digital.start()
-        if len(analog_inputs)>0:
-            input_task.start()
-        if len(digital_outputs)>0:
-            output_task_digital.start()
-        if len(analog_outputs)>0:
-            output_task.start()
+        # Reserve and program the hardware once, so that each start/stop is cheap
+        for task in tasks.values():
+            task.control(nidaqmx.constants.TaskMode.TASK_COMMIT)
 
-        if len(analog_inputs)>0:
-            data = input_task.read(number_of_samples_per_channel = nsamples)
-        if len(digital_inputs)>0:
-            data_digital = input_task_digital.read(number_of_samples_per_channel = nsamples)
+        return tasks
+
+    def get_tasks(self, analog_inputs, analog_outputs, digital_inputs, digital_outputs, input_range, nsamples):
+        '''
+        Returns the tasks for this acquisition layout, reusing the cached ones if the layout has not changed.
+        Only one set of tasks is kept, since tasks sharing channels cannot be committed at the same time.
+        '''
+        layout = self.task_layout_key(analog_inputs, analog_outputs, digital_inputs, digital_outputs,
+                                      input_range, nsamples)
+        if (self.tasks is None) or (layout != self.task_layout):
+            self.close()
+            self.tasks = self.create_tasks(analog_inputs, analog_outputs, digital_inputs, digital_outputs,
+                                           input_range, nsamples)
+            self.task_layout = layout
+        return self.tasks
+
+    def close(self):
+        '''
+        Closes the cached NI-DAQmx tasks.
+        '''
+        if self.tasks is not None:
+            for task in self.tasks.values():
+                task.close()
+        self.tasks = None
+        self.task_layout = None
 
+    def write_outputs(self, tasks, analog_outputs, digital_outputs):
+        '''
+        Writes output waveforms to the output tasks.
+        '''
         if len(analog_outputs)>0:
-            output_task.stop()
+            write_data = list(analog_outputs.values())
+            if len(write_data) == 1:
+                writer = nidaqmx.stream_writers.AnalogSingleChannelWriter(tasks['ao'].out_stream)
+                writer.write_many_sample(ascontiguousarray(write_data[0], dtype=float64))
+            else: # copy into a single 2D buffer
+                buffer = self.get_buffer('ao', (len(write_data), len(write_data[0])))
+                for i, value in enumerate(write_data):
+                    buffer[i] = value
+                writer = nidaqmx.stream_writers.AnalogMultiChannelWriter(tasks['ao'].out_stream)
+                writer.write_many_sample(buffer)
         if len(digital_outputs)>0:
-            output_task_digital.stop()
-        if len(analog_inputs)>0:
-            input_task.stop()
-        if len(digital_inputs)>0:
-            input_task_digital.stop()
-
-        # if len(analog_inputs) == 1: # maybe len(data) instead?
-        #    data = [array(data)]
-        #else:
-        #    for i in range(len(analog_inputs)):
-        #        data[i] = array(data[i])
-        n = len(analog_inputs)
-        if n == 0:
+            write_data_digital = list(digital_outputs.values())
+            if len(write_data_digital) == 1:
+                tasks['do'].write(write_data_digital[0]) #, timeout = nidaqmx.constants.WAIT_INFINITELY
+            else:
+                tasks['do'].write(array(write_data_digital)) #, timeout = nidaqmx.constants.WAIT_INFINITELY
+
+    def read_inputs(self, tasks, n_analog, n_digital, nsamples, out=None):
+        '''
+        Reads nsamples from the input tasks.
+        Analog inputs are read directly into numpy arrays: the arrays in `out` if provided,
+        otherwise a buffer that is reused by the next acquisition.
+
+        Returns
+        -------
+        Values for inputs as a list of arrays, first analog inputs, then digital inputs.
+        '''
+        if n_analog == 0:
             data = []
-        elif n == 1: # maybe len(data) instead?
-            data = [array(data)]
+        elif (n_analog == 1) and (out is not None) and (out[0].dtype == float64) and out[0].flags.c_contiguous:
+            reader = nidaqmx.stream_readers.AnalogSingleChannelReader(tasks['ai'].in_stream)
+            reader.read_many_sample(out[0], number_of_samples_per_channel = nsamples)
+            data = [out[0]]
         else:
-            for i in range(n):
-                data[i] = array(data[i])
+            buffer = self.get_buffer('ai', (n_analog, nsamples))
+            if n_analog == 1:
+                reader = nidaqmx.stream_readers.AnalogSingleChannelReader(tasks['ai'].in_stream)
+                reader.read_many_sample(buffer[0], number_of_samples_per_channel = nsamples)
+            else:
+                reader = nidaqmx.stream_readers.AnalogMultiChannelReader(tasks['ai'].in_stream)
+                reader.read_many_sample(buffer, number_of_samples_per_channel = nsamples)
+            if out is None:
+                data = list(buffer)
+            else:
+                for i in range(n_analog):
+                    copyto(out[i], buffer[i])
+                data = list(out)
 
-        n = len(digital_inputs)
-        if n == 0:
+        if n_digital == 0:
             data_digital = []
-        elif n == 1: # maybe len(data) instead?
-            data_digital = [array(data_digital)]
+        elif n_digital == 1:
+            data_digital = [array(tasks['di'].read(number_of_samples_per_channel = nsamples))]
         else:
-            for i in range(n):
-                data_digital[i] = array(data_digital[i])
+            data_digital = [array(x) for x in tasks['di'].read(number_of_samples_per_channel = nsamples)]
 
-        data= data+data_digital
+        return data+data_digital
 
-        if len(analog_inputs)>0:
-            input_task.close()
-        if len(digital_inputs)>0:
-            input_task_digital.close()
+    def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={},
+                    out=None):
+        '''
+        Acquires raw signals in volts, not scaled.
+        Virtual channels are not handled.
+
+        Tasks are kept open between calls and rebuilt only when the layout
+        (channels, ranges, clock, number of samples) changes. Call `close()` to release them.
+        If `out` is not provided, analog values are returned as views on a buffer that is
+        overwritten by the next acquisition.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes) (= measurements)
+        analog_outputs : dictionary of analog output channels (key = output channel index, value = array)
+        digital_inputs : list of digital input channels (indexes) (= measurements)
+        digital_outputs : dictionary of digital output channels (key = output channel index, value = array)
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        out : list of float arrays to write analog input values into (optional)
+
+        Returns
+        -------
+        Values for inputs as a list of arrays, first analog inputs, then digital inputs.
+        '''
         if len(analog_outputs)>0:
-            output_task.close()
-        if len(digital_outputs)>0:
-            output_task_digital.close()
+            nsamples = len(list(analog_outputs.values())[0])
+        else:
+            nsamples = len(list(digital_outputs.values())[0])
+
+        tasks = self.get_tasks(analog_inputs, analog_outputs, digital_inputs, digital_outputs, input_range, nsamples)
+
+        # Write the new waveforms
+        self.write_outputs(tasks, analog_outputs, digital_outputs)
+
+        # Start (the task providing the clock is started last)
+        for name in ['di', 'ai', 'do', 'ao']:
+            if name in tasks:
+                tasks[name].start()
+
+        data = self.read_inputs(tasks, len(analog_inputs), len(digital_inputs), nsamples, out)
+
+        # Stop, but keep the tasks for the next acquisition
+        for name in ['ao', 'do', 'ai', 'di']:
+            if name in tasks:
+                tasks[name].stop()
 
         return data
 
+    def stream_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={},
+                   chunk_size=None, nchunks=None):
+        '''
+        Continuous acquisition of raw signals in volts, not scaled, in chunks.
+        Virtual channels are not handled.
+
+        The hardware runs continuously: outputs are written `prefill` chunks ahead of the
+        inputs being read, so that there is no gap between chunks.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes) (= measurements)
+        analog_outputs : dictionary of analog output channels (key = output channel index, value = iterator over chunks)
+        digital_inputs : list of digital input channels (indexes) (= measurements)
+        digital_outputs : dictionary of digital output channels (key = output channel index, value = iterator over chunks)
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        chunk_size : number of samples per chunk
+        nchunks : number of chunks (None = until an output iterator is exhausted, or forever)
+
+        Returns
+        -------
+        A generator of values for inputs for each chunk, as a list of arrays, first analog inputs, then digital inputs.
+        '''
+        prefill = 2 # number of chunks written in advance
+        self.close() # the cached tasks may use the same channels
+        tasks = self.create_tasks(analog_inputs, dict.fromkeys(analog_outputs), digital_inputs,
+                                  dict.fromkeys(digital_outputs), input_range, 2*prefill*chunk_size, continuous=True)
+        chunks = zip_chunks(analog_outputs, digital_outputs, nchunks)
+        try:
+            written = 0
+            for _ in range(prefill):
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    self.write_outputs(tasks, *chunk)
+                    written += 1
+
+            for name in ['di', 'ai', 'do', 'ao']:
+                if name in tasks:
+                    tasks[name].start()
+
+            read = 0
+            while read < written:
+                data = self.read_inputs(tasks, len(analog_inputs), len(digital_inputs), chunk_size)
+                read += 1
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    self.write_outputs(tasks, *chunk)
+                    written += 1
+                yield data
+        finally:
+            for task in tasks.values():
+                task.stop()
+                task.close()
+
 
 if __name__ == '__main__':
     # print "Initializing"
@@ -219,7 +370,7 @@ if __name__ == '__main__':
     Vm, Im = board.acquire('Vm','Im', Ic = Ic)
     #Vm = board.acquire('Vm', Ic = Ic)
 
-    del board
+    board.close()
 
     R = (Vm[len(Vm)/2] - Vm[0])/(500*pA)
     print( R / 1e6)
@@ -0,0 +1,69 @@
+'''
+Benchmark of the lossless delta codec (`delta_encode`) against np.savez_compressed.
+
+Compares compressed size and encoding/decoding speed on synthetic traces, and on real recordings
+given on the command line (any file read by load_data, e.g. trial0.npz or trial0.txt):
+
+    python benchmark_codec.py data/trial0.npz data/trial1.npz
+'''
+from __future__ import print_function
+import io
+import sys
+import time
+import numpy as np
+from clampy.data_management import load_data
+from clampy.data_management.codec import delta_encode, delta_decode
+
+repeats = 5
+n = 200000 # number of samples (20 s at 10 kHz)
+rng = np.random.RandomState(0)
+t = np.arange(n)*1e-4
+
+# Membrane potential: slow oscillation, noise and spikes
+v = -70e-3 + 5e-3*np.sin(2*np.pi*t) + 0.5e-3*rng.randn(n)
+v[rng.randint(0, n-20, 50)[:, None] + np.arange(20)] += 80e-3*np.exp(-np.arange(20)/5.)
+
+traces = [('ADC counts (16 bits, +-10 V range)', np.round(v*10./(20./65536))*(20./65536)),
+          ('ADC counts / gain', np.round(v*10./(20./65536))*(20./65536)/10.),
+          ('ADC counts / gain 3.7, with offset', np.round(v*3.7/(20./65536))*(20./65536)/3.7 - 0.07),
+          ('Float noise', rng.randn(n)),
+          ('Command (steps)', np.repeat(rng.randn(20)*1e-10, n//20)),
+          ('Time', t)]
+for filename in sys.argv[1:]:
+    data = load_data(filename)
+    for name in data:
+        value = np.asarray(data[name])
+        if value.ndim > 0 and value.dtype.kind == 'f':
+            traces.append(('{}: {}'.format(filename, name), np.array(value)))
+
+def timed(f):
+    best = np.inf
+    for _ in range(repeats):
+        t1 = time.time()
+        result = f()
+        best = min(best, time.time()-t1)
+    return result, best
+
+def savez(x):
+    f = io.BytesIO()
+    np.savez_compressed(f, x=x)
+    return f.getvalue()
+
+def loadz(b):
+    with np.load(io.BytesIO(b)) as data:
+        return data['x']
+
+print('{:40s} {:>10s} {:>10s} {:>10s} | {:>10s} {:>10s} {:>10s}'.format('', 'ratio', 'enc MB/s', 'dec MB/s',
+                                                                      'ratio', 'enc MB/s', 'dec MB/s'))
+print('{:40s} {:>32s} | {:>32s}'.format('', 'savez_compressed', 'delta_encode'))
+for name, x in traces:
+    size = x.nbytes/1e6
+    b, t_enc1 = timed(lambda: savez(x))
+    y, t_dec1 = timed(lambda: loadz(b))
+    assert np.array_equal(x, y)
+    (data, info), t_enc2 = timed(lambda: delta_encode(x))
+    y, t_dec2 = timed(lambda: delta_decode(data, info))
+    assert np.array_equal(x.view(np.uint8), y.view(np.uint8)) # lossless
+    print('{:40s} {:10.3f} {:10.1f} {:10.1f} | {:10.3f} {:10.1f} {:10.1f}'.format(
+        name[-40:], len(b)/float(x.nbytes), size/t_enc1, size/t_dec1,
+        data.nbytes/float(x.nbytes), size/t_enc2, size/t_dec2))
@@ -0,0 +1,33 @@
+'''
+Benchmark of repeated acquisitions on the NI board, using the fake NI-DAQmx module.
+
+Compares reusing the cached tasks with rebuilding them for every sweep
+(the previous behavior, emulated by closing the tasks after each sweep).
+'''
+import time
+import fake_nidaqmx
+fake_nidaqmx.install()
+from clampy import *
+from numpy import zeros
+
+nsweeps = 200
+dt = 0.1e-3
+
+board = NI()
+board.sampling_rate = 1./dt
+board.set_analog_input('Vm', channel=0, gain=10.)
+board.set_analog_input('Im', channel=1, gain=2.5e9, min=-2e-9, max=2e-9)
+board.set_analog_output('Ic', channel=0, gain=2.5e9)
+Ic = zeros(1000)
+
+for reuse in [False, True]:
+    fake_nidaqmx.counters['tasks'] = 0
+    t1 = time.time()
+    for _ in range(nsweeps):
+        Vm, Im = board.acquire('Vm', 'Im', Ic=Ic)
+        if not reuse:
+            board.close()
+    t2 = time.time()
+    board.close()
+    print('{}: {:.2f} ms per sweep, {} tasks created'.format('Cached tasks' if reuse else 'New tasks',
+                                                             (t2-t1)/nsweeps*1000, fake_nidaqmx.counters['tasks']))
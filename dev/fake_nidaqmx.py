@@ -0,0 +1,178 @@
+'''
+A fake NI-DAQmx module, to run and benchmark the NI board without hardware.
+
+It mimics the small part of the nidaqmx API used by clampy.devices.ni.
+Task creation, configuration and commit are given an artificial cost
+(SETUP_DELAY per call), so that the cost of rebuilding tasks can be measured.
+
+Usage (before clampy is imported):
+
+    import fake_nidaqmx
+    fake_nidaqmx.install()
+    from clampy import *
+'''
+import sys
+import time
+import types
+import numpy as np
+
+__all__ = ['Task', 'install', 'counters']
+
+SETUP_DELAY = 1e-3 # cost of each configuration call, in second
+REALTIME = False # if True, reading takes as long as the acquisition would
+
+# Number of calls, for benchmarking
+counters = dict(tasks=0, configurations=0, starts=0, reads=0)
+
+def _setup_cost():
+    counters['configurations'] += 1
+    if SETUP_DELAY > 0:
+        time.sleep(SETUP_DELAY)
+
+class LineGrouping(object):
+    CHAN_PER_LINE = 0
+    CHAN_FOR_ALL_LINES = 1
+
+class TaskMode(object):
+    TASK_START = 0
+    TASK_STOP = 1
+    TASK_VERIFY = 2
+    TASK_COMMIT = 3
+    TASK_RESERVE = 4
+    TASK_UNRESERVE = 5
+    TASK_ABORT = 6
+
+class AcquisitionType(object):
+    FINITE = 10178
+    CONTINUOUS = 10123
+
+class RegenerationMode(object):
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
+
+class _InStream(object):
+    def __init__(self, task):
+        self.task = task
+
+class _OutStream(object):
+    def __init__(self, task):
+        self.task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+
+class _Reader(object):
+    def __init__(self, in_stream):
+        self.task = in_stream.task
+
+    def read_many_sample(self, data, number_of_samples_per_channel=1, timeout=10.):
+        counters['reads'] += 1
+        if REALTIME:
+            time.sleep(number_of_samples_per_channel / self.task.timing.rate)
+        data[...] = np.random.randn(*data.shape) * 1e-3
+        return number_of_samples_per_channel
+
+class _Writer(object):
+    def __init__(self, out_stream):
+        self.task = out_stream.task
+
+    def write_many_sample(self, data, timeout=10.):
+        self.task.written = data.copy()
+        return data.shape[-1]
+
+class _Channels(object):
+    def __init__(self, task):
+        self.task = task
+        self.names = []
+
+    def _add(self, name, **kwds):
+        _setup_cost()
+        self.names.append(name)
+
+    add_ai_voltage_chan = _add
+    add_ao_voltage_chan = _add
+    add_di_chan = _add
+    add_do_chan = _add
+
+class _Timing(object):
+    def __init__(self):
+        self.rate = None
+        self.samps_per_chan = None
+        self.sample_mode = AcquisitionType.FINITE
+
+    def cfg_samp_clk_timing(self, rate, source=None, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000, **kwds):
+        _setup_cost()
+        self.rate = rate
+        self.sample_mode = sample_mode
+        self.samps_per_chan = samps_per_chan
+
+class Task(object):
+    def __init__(self, new_task_name=''):
+        _setup_cost()
+        counters['tasks'] += 1
+        self.ai_channels = _Channels(self)
+        self.ao_channels = _Channels(self)
+        self.di_channels = _Channels(self)
+        self.do_channels = _Channels(self)
+        self.timing = _Timing()
+        self.in_stream = _InStream(self)
+        self.out_stream = _OutStream(self)
+        self.committed = False
+        self.running = False
+        self.closed = False
+        self.written = None
+
+    def _nchannels(self):
+        return sum(len(c.names) for c in [self.ai_channels, self.ao_channels, self.di_channels, self.do_channels])
+
+    def control(self, action):
+        if action == TaskMode.TASK_COMMIT and not self.committed:
+            _setup_cost()
+            self.committed = True
+
+    def write(self, data, auto_start=False, timeout=10.):
+        self.written = np.array(data)
+        return self.written.shape[-1]
+
+    def start(self):
+        if not self.committed: # implicit commit, as in NI-DAQmx
+            _setup_cost()
+        counters['starts'] += 1
+        self.running = True
+
+    def read(self, number_of_samples_per_channel=1, timeout=10.):
+        counters['reads'] += 1
+        if REALTIME:
+            time.sleep(number_of_samples_per_channel / self.timing.rate)
+        data = np.random.randn(self._nchannels(), number_of_samples_per_channel) * 1e-3
+        if self._nchannels() == 1:
+            return data[0].tolist()
+        else:
+            return data.tolist()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.closed = True
+
+def install():
+    '''
+    Registers this module as `nidaqmx` in sys.modules.
+    '''
+    module = sys.modules[__name__]
+    constants = types.ModuleType('nidaqmx.constants')
+    constants.LineGrouping = LineGrouping
+    constants.TaskMode = TaskMode
+    constants.AcquisitionType = AcquisitionType
+    constants.RegenerationMode = RegenerationMode
+    module.constants = constants
+    stream_readers = types.ModuleType('nidaqmx.stream_readers')
+    stream_readers.AnalogSingleChannelReader = _Reader
+    stream_readers.AnalogMultiChannelReader = _Reader
+    module.stream_readers = stream_readers
+    stream_writers = types.ModuleType('nidaqmx.stream_writers')
+    stream_writers.AnalogSingleChannelWriter = _Writer
+    stream_writers.AnalogMultiChannelWriter = _Writer
+    module.stream_writers = stream_writers
+    sys.modules['nidaqmx'] = module
+    for submodule in [constants, stream_readers, stream_writers]:
+        sys.modules[submodule.__name__] = submodule
@@ -12,8 +12,8 @@ def do_analysis(path):
     # Loading
     info = load_info(path+'/current_clamp_experiment.info')
     dt = info['dt']
-    Ic = loadtxt(path+'/Steps/I.txt')
-    V = loadtxt(path+'/Steps/V.txt')
+    Ic = cached_loadtxt(path+'/Steps/I.txt') # parsed once, then memory-mapped
+    V = cached_loadtxt(path+'/Steps/V.txt')
     # Plotting
     figure()
     t = dt*arange(len(Ic))
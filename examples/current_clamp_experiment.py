@@ -26,21 +26,21 @@ shutil.copy('current_clamp_analysis.py',path)
 
 # Experiment
 os.mkdir(path+'/Steps')
-V = []
+commands = []
 for ampli in linspace(-1,1,ntrials)*nA:
-    print 'Amplitude ',ampli
     Ic = sequence([constant(10*ms, dt)*0*amp,
                    constant(60*ms, dt)*ampli,
                    constant(130*ms, dt)*0*amp])
-    V.append(board.acquire('V', Ic=Ic))
+    commands.append(Ic)
+# All sweeps in a single run, 100 ms apart
+V = board.acquire_sweeps('V', Ic=commands, inter_sweep_interval=100*ms)
 
 # Save data
 savetxt(path+'/Steps/I.txt',Ic)
 savetxt(path+'/Steps/V.txt',V)
 
 # Save parameter values
-save_info(dict(amplitude=float(ampli), duration=len(Ic)*float(dt), dt=float(dt)),
-          path+'/current_clamp_experiment.info')
+save_info(path+'/current_clamp_experiment.info', amplitude=float(ampli), duration=len(Ic)*float(dt), dt=float(dt))
 
 # Plot
 do_analysis(path)
@@ -29,21 +29,21 @@ if do_experiment:
 
     # Experiment
     os.mkdir(path+'/Steps')
-    I = []
+    commands = []
     for ampli in linspace(-100,20,ntrials)*mV:
-        print('Amplitude: {}'.format(str(ampli)))
         Vc = sequence([constant(10*ms, dt)*0*mV,
                        constant(60*ms, dt)*ampli,
                        constant(130*ms, dt)*0*mV])
-        I.append(board.acquire('I', V=Vc))
+        commands.append(Vc)
+    # All sweeps in a single run, 100 ms apart
+    I = board.acquire_sweeps('I', V=commands, inter_sweep_interval=100*ms)
 
     # Save data
     savetxt(path+'/Steps/I.txt',I)
     savetxt(path+'/Steps/V.txt',Vc)
 
     # Save parameter values
-    save_info(dict(amplitude=float(ampli), duration=len(Vc)*float(dt), dt=float(dt)),
-              path+'/voltage_clamp_experiment.info')
+    save_info(path+'/voltage_clamp_experiment.info', amplitude=float(ampli), duration=len(Vc)*float(dt), dt=float(dt))
 else: # Loading the data after the experiment
     from clampy.setup.units import *
     path = '.'
@@ -13,5 +13,6 @@ setup(
         'Programming Language :: Python :: 2.7'
     ],
     packages=find_packages(),
-    install_requires=['numpy', 'scipy', 'brian2', 'nidaqmx']
+    install_requires=['numpy', 'scipy', 'brian2', 'nidaqmx', 'futures; python_version < "3"'],
+    entry_points={'console_scripts': ['clampy-convert=clampy.data_management.convert:main']}
 )
@@ -0,0 +1,118 @@
+'''
+Round-trip tests of signal storage: lossless delta codec, and float32/int16 storage.
+'''
+import io
+import json
+import numpy as np
+import pytest
+from clampy.data_management.codec import delta_encode, delta_decode
+from clampy.data_management.storage import encode_signals, StoredData
+
+lsb = 20./65536 # 16-bit ADC on +-10 V
+
+def adc_counts(n=20000, seed=0):
+    rng = np.random.RandomState(seed)
+    return np.cumsum(rng.randint(-30, 31, n))
+
+def round_trip(value, step=None):
+    data, info = delta_encode(value, step)
+    return delta_decode(data, info), json.loads(info), data
+
+def assert_identical(x, y):
+    # Same type, shape and bits (distinguishes -0.0 and NaN payloads)
+    x = np.asarray(x)
+    assert y.dtype == x.dtype
+    assert y.shape == x.shape
+    assert x.tobytes() == y.tobytes()
+
+@pytest.mark.parametrize('value', [
+    np.arange(1000)/10000., # time
+    adc_counts()*lsb, # ADC counts
+    adc_counts()*lsb/10., # divided by a gain
+    adc_counts()*lsb/2.5e9, # current, with gain not a power of 2
+    adc_counts()*lsb/3.7 - 0.07, # with an offset
+    (adc_counts()*lsb/3.7).astype(np.float32),
+    np.random.RandomState(0).randn(5000), # not quantized
+    np.random.RandomState(0).randn(5000).astype(np.float32),
+    (adc_counts()*lsb/10.).reshape(4, -1), # 2D
+    np.repeat(np.random.RandomState(0).randn(10), 1000), # steps
+    np.zeros(100), np.ones(100)*0.3,
+    adc_counts().astype(np.int16), adc_counts().astype(np.int64), np.arange(100, dtype=np.uint64)*2**60,
+    np.random.RandomState(0).rand(1000) > .5,
+], ids=['time', 'adc', 'adc/10', 'adc/2.5e9', 'offset', 'float32', 'noise', 'noise float32', '2D', 'steps',
+        'zeros', 'constant', 'int16', 'int64', 'uint64', 'bool'])
+def test_delta_round_trip(value):
+    y, _, _ = round_trip(value)
+    assert_identical(value, y)
+
+def test_negative_zero():
+    x = adc_counts()*lsb/10.
+    x[x == 0] = -0.
+    x[5] = -0.
+    y, info, _ = round_trip(x)
+    assert_identical(x, y)
+    assert info['mode'] == 'quantized'
+    assert np.all(np.signbit(y[x == 0]) == np.signbit(x[x == 0]))
+
+def test_non_finite():
+    x = adc_counts()*lsb
+    x[[3, 10, 20]] = [np.nan, np.inf, -np.inf]
+    y, _, _ = round_trip(x)
+    assert_identical(x, y)
+
+@pytest.mark.parametrize('value', [np.array(3.), np.array(-0.), np.array(np.nan), np.array(5), np.array(True),
+                                   np.zeros(0), np.zeros((2, 0)), np.zeros(0, dtype=np.int16)])
+def test_zero_dimensional_and_empty(value):
+    y, _, _ = round_trip(value)
+    assert_identical(value, y)
+
+def test_scaled_adc_compression():
+    # Scaled ADC signals are quantized (not stored as bit patterns), and compress better with the known step
+    x = adc_counts(100000)*lsb/2.5e9
+    _, info, data = round_trip(x)
+    assert info['mode'] == 'quantized'
+    _, info_step, data_step = round_trip(x, lsb/2.5e9)
+    assert info_step['mode'] == 'quantized'
+    assert data_step.nbytes <= data.nbytes < x.nbytes/4
+
+def test_wrong_step():
+    # A step that does not match the values is ignored
+    x = adc_counts()*lsb/3.7
+    y, info, _ = round_trip(x, step=0.123)
+    assert_identical(x, y)
+    assert info['mode'] == 'quantized'
+
+def stored(signals, storage, dt=1e-4):
+    # Signals encoded, written to a .npz file, then read back
+    f = io.BytesIO()
+    np.savez(f, **encode_signals(signals, storage, dt=dt))
+    f.seek(0)
+    return StoredData(np.load(f))
+
+@pytest.mark.parametrize('storage', ['float64', 'float32', 'int16', 'delta'])
+def test_storage_round_trip(storage):
+    n = 10000
+    V = adc_counts(n)*lsb/10.
+    V[7] = -0.
+    signals = dict(V=V, D=np.arange(n) % 3 == 0, t=np.arange(n)*1e-4, acquisition_time=12.5, gain_V=10.)
+    data = stored(signals, storage)
+    assert sorted(data.keys()) == sorted(signals.keys())
+    assert np.array_equal(data['D'], signals['D'])
+    assert float(data['acquisition_time']) == 12.5
+    assert np.allclose(data['t'], signals['t'], rtol=0, atol=1e-12)
+    if storage in ['float64', 'delta']: # lossless
+        assert_identical(V, data['V'])
+    elif storage == 'float32':
+        assert np.allclose(data['V'], V, rtol=1e-6, atol=0)
+    else: # int16: error at most half a level of the range
+        assert np.abs(data['V'] - V).max() <= (V.max() - V.min())/65534.
+
+@pytest.mark.parametrize('storage', ['float32', 'int16', 'delta'])
+def test_storage_special_values(storage):
+    # Non-finite values are kept (int16 falls back to float32), as well as 0-d and empty arrays
+    V = adc_counts(1000)*lsb
+    V[[1, 2]] = [np.nan, np.inf]
+    data = stored(dict(V=V, empty=np.zeros(0), scalar=np.array(2.5)), storage, dt=None)
+    assert np.array_equal(data['V'], V.astype(data['V'].dtype), equal_nan=True)
+    assert data['empty'].shape == (0,)
+    assert data['scalar'].shape == () and float(data['scalar']) == 2.5
@@ -129,12 +129,27 @@ lag_button.on_changed(change_lag)
 
 display_title()
 
-def update(i):
+def start_sweep():
+    # Returns the mode and the future result of a new sweep
     if current_clamp:
-        V = board.acquire('V', Ic1=Ic)
+        return True, board.acquire_async('V', Ic1=Ic)
+    else:
+        return False, board.acquire_async('V', 'I_TEVC', Vc=Vc)
+
+sweep = None # sweep in progress
+
+def update(i):
+    global sweep
+    if sweep is None:
+        sweep = start_sweep()
+    clamp, future = sweep
+    # The next sweep is acquired while this one is processed and plotted
+    sweep = start_sweep()
+    if clamp:
+        V = future.result()
         I = Ic
     else:
-        V, I = board.acquire('V', 'I_TEVC', Vc=Vc)
+        V, I = future.result()
     # Calculate offset and resistance
     V0 = median(V[:int(T0/dt)]) # calculated on initial pause
     Vpeak = median(V[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
@@ -8,6 +8,7 @@ TODO:
 from clampy import *
 from pylab import *
 from clampy.signals import *
+from clampy.analysis.online_spikes import OnlineSpikeDetector
 from init_rig import *
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
@@ -28,6 +29,7 @@ plt.subplots_adjust(bottom=0.2)
 plt.xlabel('Time (ms)')
 plt.ylabel('V (mV)')
 resistance_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
+rate_text = ax.text(0.05, 0.82, '', transform=ax.transAxes)
 
 t = dt*arange(len(Ic))
 xlim(0,max(t/ms))
@@ -55,6 +57,8 @@ switch_button.on_clicked(callback)
 
 display_title()
 
+detector = OnlineSpikeDetector(dt, vc=-20*mV, criterion=10*volt/second*dt, rate_window=T0+T1+T2)
+
 def update(i):
     if swap:
         V = board.acquire('V2', Ic2=Ic)
@@ -64,9 +68,13 @@ def update(i):
     V0 = median(V[:int(T0/dt)]) # calculated on initial pause
     Vpeak = median(V[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
     R = (Vpeak-V0)/I0
+    # Spikes
+    detector.reset()
+    spikes = detector.process(V)
     # Plot
     line.set_ydata(V/mV)
     resistance_text.set_text('{:.1f} MOhm'.format(R/Mohm))
+    rate_text.set_text('{} spikes, {:.1f} Hz'.format(len(spikes['peak']), detector.rate()))
     return line,
 
 anim = animation.FuncAnimation(fig,update)
@@ -83,8 +83,19 @@ stim_value = TextBox(ax_stim_value, 'VC (mV):', '-10')
 stim_value.on_submit(value_callback)
 
 
+plan = board.prepare('I', Vc=len(Vc))
+future = None # sweep in progress
+
 def update(i):
-    I = board.acquire('I', Vc=Vc*factor)
+    global plan, future
+    if not plan.valid: # the board or amplifier configuration has changed
+        plan = board.prepare('I', Vc=len(Vc))
+        future = None # the sweep in progress may use the previous configuration
+    if future is None:
+        future = plan.run_async(Vc=Vc*factor)
+    I = future.result()
+    # The next sweep is acquired while this one is processed and plotted
+    future = plan.run_async(Vc=Vc*factor)
     ## Calculate offset and resistance
     if abs(factor) > 0:
         I0 = median(I[:int(T0/dt)]) # calculated on initial pause
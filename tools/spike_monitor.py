@@ -0,0 +1,60 @@
+'''
+Continuous recording in current clamp, showing the voltage trace and the firing rate in real time.
+
+Spikes are detected online, with a spike criterion and an onset criterion learned on the first second.
+'''
+from pylab import *
+from clampy.analysis.online_spikes import OnlineSpikeDetector
+from init_rig import *
+import matplotlib.animation as animation
+import matplotlib.pyplot as plt
+
+I0 = 0.5*nA # constant current
+chunk_size = 2000
+duration = 2*second # duration of the displayed trace
+rate_duration = 60*second # duration of the displayed firing rate
+
+n = int(duration/dt)//chunk_size*chunk_size
+V_display = zeros(n)
+rate_display = zeros(int(rate_duration/(chunk_size*dt)))
+
+fig, (ax_V, ax_rate) = plt.subplots(2, 1)
+t = dt*arange(n)
+ax_V.set_xlim(0, max(t/ms))
+ax_V.set_ylim(-100, 60)
+ax_V.set_xlabel('Time (ms)')
+ax_V.set_ylabel('V (mV)')
+line, = ax_V.plot(t/ms, V_display)
+spike_markers, = ax_V.plot([], [], 'r.')
+t_rate = -rate_duration/second + chunk_size*dt*arange(len(rate_display))/second
+ax_rate.set_xlim(min(t_rate), 0)
+ax_rate.set_ylim(0, 50)
+ax_rate.set_xlabel('Time (s)')
+ax_rate.set_ylabel('Rate (Hz)')
+rate_line, = ax_rate.plot(t_rate, rate_display)
+rate_text = ax_rate.text(0.05, 0.85, '', transform=ax_rate.transAxes)
+
+detector = OnlineSpikeDetector(dt, learning_time=1*second, update_interval=10*second, rate_window=1*second)
+stream = detector.process_stream(board.stream('V', Ic=I0*ones(chunk_size), chunk_size=chunk_size))
+position = 0
+
+def update(i):
+    global position
+    V, spikes = next(stream)
+    # Trace, drawn from left to right
+    V_display[position:position+len(V)] = V/mV
+    peaks = array(detector.peaks, dtype=int)
+    peaks = peaks[peaks >= detector.n - position - len(V)] - (detector.n - position - len(V))
+    position = (position + len(V)) % n
+    line.set_ydata(V_display)
+    spike_markers.set_data(t[peaks]/ms, V_display[peaks])
+    # Firing rate
+    rate_display[:-1] = rate_display[1:]
+    rate_display[-1] = detector.rate()
+    rate_line.set_ydata(rate_display)
+    rate_text.set_text('{:.1f} Hz'.format(rate_display[-1]))
+    return line, spike_markers, rate_line, rate_text
+
+anim = animation.FuncAnimation(fig, update, interval=0)
+
+show()